@@ -0,0 +1,82 @@
+"""
+Peak memory of building an inline (Base64 JSON) ticket response, old encoder vs
+responses.inline_response, for 1, 5 and 10 MB PDFs:
+
+    python bench_response_memory.py [size_mb ...]
+
+Every measurement runs in a fresh interpreter and reports how far peak RSS rose
+above the RSS measured right after the PDF bytes were allocated, i.e. the cost
+of the response on top of the PDF: once for building the response ('encode')
+and once more after serializing it with json.dumps, as the Lambda runtime does
+with a handler's return value ('total').
+"""
+import base64
+import json
+import os
+import resource
+import subprocess
+import sys
+
+from responses import inline_response
+
+FIELDS = {
+    "message": "PDF generated and uploaded successfully.",
+    "s3_path": "s3://bucket/event/user/ticket.pdf",
+    "missing_variables": [],
+    "unused_variables": [],
+    "render_cache": "miss",
+}
+
+
+def legacy_response(pdf_bytes):
+    pdf_base64_string = base64.b64encode(pdf_bytes).decode("utf-8")
+    return {
+        "statusCode": 200,
+        "headers": {"Content-Type": "application/json"},
+        "body": json.dumps(dict(FIELDS, pdf_base64=pdf_base64_string)),
+    }
+
+
+def buffered_response(pdf_bytes):
+    return inline_response(FIELDS, pdf_bytes)
+
+
+def peak_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def measure(encoder, size_mb):
+    pdf_bytes = os.urandom(int(size_mb * 1024 * 1024))
+    baseline = peak_rss_bytes()
+    response = encoder(pdf_bytes)
+    encode_peak = peak_rss_bytes() - baseline
+    json.dumps(response)
+    return encode_peak, peak_rss_bytes() - baseline
+
+
+def main(sizes):
+    columns = [f"{encoder} {phase}" for encoder in ("legacy", "buffered") for phase in ("encode", "total")]
+    print(f"{'PDF size':>10} " + " ".join(f"{column:>18}" for column in columns))
+    for size_mb in sizes:
+        peaks = []
+        for encoder in ("legacy", "buffered"):
+            output = subprocess.run(
+                [sys.executable, __file__, "--measure", encoder, str(size_mb)],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+            peaks.extend(int(value) for value in output.split())
+        print(
+            f"{size_mb:>7g} MB "
+            + " ".join(f"{peak / 2**20:>10.1f} MB ({peak / (size_mb * 2**20):.1f}x)" for peak in peaks)
+        )
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--measure"]:
+        encoder = legacy_response if sys.argv[2] == "legacy" else buffered_response
+        print(*measure(encoder, float(sys.argv[3])))
+    else:
+        main([float(size) for size in sys.argv[1:]] or [1, 5, 10])
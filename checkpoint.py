@@ -0,0 +1,75 @@
+import json
+import uuid
+
+from botocore.exceptions import ClientError
+
+
+class TimeBudget:
+    """
+    Tracks the time left in an invocation through the Lambda context. Work is
+    done in rounds; the budget is exhausted once what's left would not cover the
+    reserve plus the longest round seen so far. Without a context (local runs)
+    it never runs out.
+    """
+
+    def __init__(self, context, reserve_ms):
+        self.context = context
+        self.reserve_ms = reserve_ms
+        self.longest_round_ms = 0
+
+    def remaining_ms(self):
+        if self.context is None:
+            return float("inf")
+        return self.context.get_remaining_time_in_millis()
+
+    def record_round(self, seconds):
+        self.longest_round_ms = max(self.longest_round_ms, seconds * 1000)
+
+    def exhausted(self):
+        return self.remaining_ms() < self.reserve_ms + self.longest_round_ms
+
+
+class CheckpointStore:
+    """
+    Persists the state of a paused batch in S3 under '{prefix}{token}.json'.
+    The token doubles as the continuation token handed back to the caller.
+    """
+
+    def __init__(self, s3_client, bucket, prefix="checkpoints/"):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def new_token(self):
+        return uuid.uuid4().hex
+
+    def key(self, token):
+        # Tokens come back from callers: only accept what new_token() produces
+        if not isinstance(token, str) or not token or not all(c in "0123456789abcdef" for c in token):
+            raise ValueError("Invalid continuation token.")
+        return f"{self.prefix}{token}.json"
+
+    def save(self, token, state):
+        self.s3_client.put_object(
+            Bucket=self.bucket,
+            Key=self.key(token),
+            Body=json.dumps(state).encode("utf-8"),
+            ContentType="application/json",
+        )
+
+    def load(self, token):
+        """
+        The saved state of 'token'. Raises ValueError for a malformed token and
+        LookupError for one with no checkpoint (never issued, or already finished).
+        """
+        try:
+            s3_response = self.s3_client.get_object(Bucket=self.bucket, Key=self.key(token))
+        except ClientError as e:
+            # Without s3:ListBucket, S3 answers a missing key with 403 instead of 404
+            if e.response.get("Error", {}).get("Code") not in ("404", "NoSuchKey", "403", "AccessDenied"):
+                raise
+            raise LookupError("Unknown continuation token.") from e
+        return json.loads(s3_response["Body"].read())
+
+    def delete(self, token):
+        self.s3_client.delete_object(Bucket=self.bucket, Key=self.key(token))
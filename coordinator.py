@@ -0,0 +1,197 @@
+"""
+Fan-out of large render jobs across many worker invocations.
+
+A job is split into chunks that are written to S3 next to a job record:
+
+    {prefix}{job_id}/job.json              job settings and chunk count
+    {prefix}{job_id}/chunks/{n:05d}.json   the items of chunk n
+    {prefix}{job_id}/status/{n:05d}.json   written by the worker once chunk n is done or has failed
+    {prefix}{job_id}/work-items.json       (Step Functions only) the Distributed Map input
+
+Each chunk is handed to a worker as a small work item
+({"bucket", "job_id", "chunk_index", "chunk_key"}), which is also the item
+shape a Step Functions Distributed Map iterates over. How work items reach
+workers is up to the invoker, so the same flow runs in-process for local tests
+and benchmarks.
+"""
+import itertools
+import json
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+def chunk_size_for(seconds_per_item, target_seconds, max_size, total_items=None):
+    """
+    Largest chunk expected to finish within 'target_seconds' (keeping each worker
+    well inside the Lambda timeout), capped at 'max_size' and, when known, at the
+    job size.
+    """
+    size = min(int(target_seconds / max(seconds_per_item, 1e-6)), max_size)
+    if total_items:
+        size = min(size, total_items)
+    return max(1, size)
+
+
+def new_job_id():
+    return time.strftime("%Y%m%dT%H%M%S") + "-" + uuid.uuid4().hex[:8]
+
+
+class JobStore:
+    """Reads and writes job records, chunks and chunk statuses in S3."""
+
+    def __init__(self, s3_client, bucket, prefix="jobs/"):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def job_key(self, job_id):
+        return f"{self.prefix}{job_id}/job.json"
+
+    def chunk_key(self, job_id, chunk_index):
+        return f"{self.prefix}{job_id}/chunks/{chunk_index:05d}.json"
+
+    def status_key(self, job_id, chunk_index):
+        return f"{self.prefix}{job_id}/status/{chunk_index:05d}.json"
+
+    def put_json(self, key, value):
+        self.s3_client.put_object(
+            Bucket=self.bucket,
+            Key=key,
+            Body=json.dumps(value).encode("utf-8"),
+            ContentType="application/json",
+        )
+
+    def get_json(self, key):
+        s3_response = self.s3_client.get_object(Bucket=self.bucket, Key=key)
+        return json.loads(s3_response["Body"].read())
+
+    def write_chunks(self, job_id, items, chunk_size):
+        """
+        Writes 'items' (any iterable, consumed lazily) as chunk objects.
+        Returns (work_items, total_items), with one work item per chunk.
+        """
+        work_items = []
+        items = iter(items)
+        start = 0
+        for chunk_index in itertools.count():
+            chunk = list(itertools.islice(items, chunk_size))
+            if not chunk:
+                break
+            chunk_key = self.chunk_key(job_id, chunk_index)
+            self.put_json(chunk_key, {"start": start, "items": chunk})
+            work_items.append(
+                {
+                    "bucket": self.bucket,
+                    "job_id": job_id,
+                    "chunk_index": chunk_index,
+                    "chunk_key": chunk_key,
+                }
+            )
+            start += len(chunk)
+        return work_items, start
+
+    def job_status(self, job_id):
+        """Aggregates the chunk statuses written so far into a job progress summary."""
+        job = self.get_json(self.job_key(job_id))
+        summary = {
+            "job_id": job_id,
+            "chunks": job["chunk_count"],
+            "chunks_done": 0,
+            "total_items": job["total_items"],
+            "succeeded": 0,
+            "failed": 0,
+            "failures": [],
+            "failed_chunks": [],
+        }
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=f"{self.prefix}{job_id}/status/"):
+            for item in page.get("Contents", []):
+                status = self.get_json(item["Key"])
+                summary["chunks_done"] += 1
+                summary["succeeded"] += status["succeeded"]
+                summary["failed"] += status["failed"]
+                summary["failures"].extend(status.get("failures", []))
+                if status.get("error"):
+                    summary["failed_chunks"].append(
+                        {"chunk_index": status["chunk_index"], "error": status["error"]}
+                    )
+        summary["complete"] = summary["chunks_done"] >= summary["chunks"]
+        return summary
+
+
+class InProcessInvoker:
+    """Runs the worker handler in this process, for local runs and benchmarks."""
+
+    def __init__(self, handler, max_workers=1):
+        self.handler = handler
+        self.max_workers = max_workers
+
+    def dispatch(self, job_id, work_items):
+        if self.max_workers <= 1:
+            return [self.handler(work_item, None) for work_item in work_items]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(lambda work_item: self.handler(work_item, None), work_items))
+
+
+class LambdaInvoker:
+    """Dispatches every chunk as an asynchronous ('Event') invocation of the worker function."""
+
+    def __init__(self, lambda_client, function_name):
+        if not function_name:
+            raise ValueError("No chunk worker function configured (CHUNK_WORKER_FUNCTION_NAME).")
+        self.lambda_client = lambda_client
+        self.function_name = function_name
+
+    def dispatch(self, job_id, work_items):
+        for work_item in work_items:
+            self.lambda_client.invoke(
+                FunctionName=self.function_name,
+                InvocationType="Event",
+                Payload=json.dumps(work_item).encode("utf-8"),
+            )
+
+
+class StepFunctionsInvoker:
+    """
+    Writes the work items as a JSON array and starts a state machine whose
+    Distributed Map reads it (ItemReader: s3:getObject, InputType JSON) and runs
+    the worker function once per item.
+    """
+
+    def __init__(self, sfn_client, state_machine_arn, store):
+        if not state_machine_arn:
+            raise ValueError("No chunk state machine configured (CHUNK_STATE_MACHINE_ARN).")
+        self.sfn_client = sfn_client
+        self.state_machine_arn = state_machine_arn
+        self.store = store
+
+    def dispatch(self, job_id, work_items):
+        items_key = f"{self.store.prefix}{job_id}/work-items.json"
+        self.store.put_json(items_key, work_items)
+        self.sfn_client.start_execution(
+            stateMachineArn=self.state_machine_arn,
+            name=job_id,
+            input=json.dumps({"bucket": self.store.bucket, "key": items_key}),
+        )
+
+
+def start_job(store, invoker, job_settings, items, chunk_size):
+    """
+    Splits 'items' into chunks of 'chunk_size', records the job and dispatches
+    one work item per chunk. Returns the job record.
+    """
+    job_id = new_job_id()
+    work_items, total_items = store.write_chunks(job_id, items, chunk_size)
+    job = dict(
+        job_settings,
+        job_id=job_id,
+        chunk_size=chunk_size,
+        chunk_count=len(work_items),
+        total_items=total_items,
+        created_at=time.time(),
+    )
+    # Written before dispatching: workers read it, and status checks count against it
+    store.put_json(store.job_key(job_id), job)
+    invoker.dispatch(job_id, work_items)
+    return job
@@ -0,0 +1,120 @@
+"""
+Offline font bundle.
+
+Our templates pull their fonts from Google Fonts with '@import url(...)'. Inside
+Lambda that means outbound HTTP on every render (or a broken render with no
+egress), so the fonts are vendored into the image at build time:
+
+    python font_bundle.py /usr/share/fonts/ticket-fonts && fc-cache -f
+
+and OfflineFontFetcher answers the allowlisted Google Fonts stylesheet URLs with
+a local @font-face stylesheet pointing at those files.
+"""
+import os
+import sys
+import urllib.request
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+FONT_BUNDLE_DIR = os.environ.get("FONT_BUNDLE_DIR", "/usr/share/fonts/ticket-fonts")
+
+# Set OFFLINE_FONTS_STRICT=false to let unmapped font URLs through to the network
+OFFLINE_FONTS_STRICT = os.environ.get("OFFLINE_FONTS_STRICT", "true").lower() == "true"
+
+NOTO_SERIF_BASE = (
+    "https://github.com/notofonts/notofonts.github.io/raw/main/fonts/NotoSerif/hinted/ttf"
+)
+
+# family -> [(font-weight, font-style, filename, download url)]
+BUNDLED_FONTS = {
+    "Noto Serif": [
+        ("400", "normal", "NotoSerif-Regular.ttf", f"{NOTO_SERIF_BASE}/NotoSerif-Regular.ttf"),
+        ("700", "normal", "NotoSerif-Bold.ttf", f"{NOTO_SERIF_BASE}/NotoSerif-Bold.ttf"),
+        ("400", "italic", "NotoSerif-Italic.ttf", f"{NOTO_SERIF_BASE}/NotoSerif-Italic.ttf"),
+        ("700", "italic", "NotoSerif-BoldItalic.ttf", f"{NOTO_SERIF_BASE}/NotoSerif-BoldItalic.ttf"),
+    ],
+}
+
+# Allowlist of remote stylesheet endpoints we know how to answer from the bundle
+REMOTE_FONT_STYLESHEETS = (
+    "https://fonts.googleapis.com/css",
+    "https://fonts.googleapis.com/css2",
+)
+
+# Hosts that are never fetched when running strict
+REMOTE_FONT_HOSTS = ("fonts.googleapis.com", "fonts.gstatic.com")
+
+
+def requested_families(url):
+    """
+    Returns the font families named in a Google Fonts stylesheet URL, e.g.
+    'css2?family=Noto+Serif:wght@400;700' -> ['Noto Serif'].
+    """
+    families = []
+    for value in parse_qs(urlsplit(url).query).get("family", []):
+        # css2 uses one 'family' per font, the legacy css API separates with '|'
+        for family in value.split("|"):
+            families.append(family.split(":", 1)[0].strip())
+    return families
+
+
+def font_face_css(families, font_dir):
+    rules = []
+    for family in families:
+        for weight, style, filename, _ in BUNDLED_FONTS[family]:
+            if not (Path(font_dir) / filename).exists():
+                continue
+            rules.append(
+                "@font-face { "
+                f"font-family: '{family}'; font-weight: {weight}; font-style: {style}; "
+                f"src: url('{filename}'); "
+                "}"
+            )
+    return "\n".join(rules)
+
+
+class OfflineFontFetcher:
+    """
+    url_fetcher that serves allowlisted Google Fonts stylesheets from the local
+    font bundle. Everything else is passed to the wrapped fetcher, except other
+    requests to the Google Fonts hosts, which fail fast when running strict.
+    """
+
+    def __init__(self, fetcher=None, font_dir=FONT_BUNDLE_DIR, strict=OFFLINE_FONTS_STRICT):
+        if fetcher is None:
+            from weasyprint import default_url_fetcher as fetcher
+        self.fetcher = fetcher
+        self.font_dir = font_dir
+        self.strict = strict
+        self.base_url = Path(font_dir).resolve().as_uri() + "/"
+
+    def __call__(self, url, *args, **kwargs):
+        if url.split("?", 1)[0] in REMOTE_FONT_STYLESHEETS:
+            families = requested_families(url)
+            if families and all(family in BUNDLED_FONTS for family in families):
+                return {
+                    "string": font_face_css(families, self.font_dir).encode("utf-8"),
+                    "mime_type": "text/css",
+                    "encoding": "utf-8",
+                    "redirected_url": self.base_url,
+                }
+        if self.strict and urlsplit(url).hostname in REMOTE_FONT_HOSTS:
+            raise ValueError(f"Font URL is not in the offline font bundle: {url}")
+        return self.fetcher(url, *args, **kwargs)
+
+
+def download_fonts(font_dir):
+    """Downloads every bundled font file missing from 'font_dir'."""
+    os.makedirs(font_dir, exist_ok=True)
+    for faces in BUNDLED_FONTS.values():
+        for _, _, filename, source_url in faces:
+            target = Path(font_dir) / filename
+            if target.exists():
+                continue
+            print(f"Downloading {source_url} -> {target}")
+            with urllib.request.urlopen(source_url) as response:
+                target.write_bytes(response.read())
+
+
+if __name__ == "__main__":
+    download_fonts(sys.argv[1] if len(sys.argv) > 1 else FONT_BUNDLE_DIR)
@@ -0,0 +1,130 @@
+import io
+
+import pikepdf
+from pikepdf import Name, Rectangle
+
+# Sheet sizes in PDF points (portrait)
+SHEET_SIZES = {
+    "letter": (612.0, 792.0),
+    "a4": (595.28, 841.89),
+}
+
+CROP_MARK_LENGTH = 12.0
+CROP_MARK_OFFSET = 3.0
+
+
+class ImpositionLayout:
+    """
+    Sheet layout for N-up printing, read from the request's 'imposition' object:
+
+        {"sheet": "letter", "orientation": "landscape", "rows": 1, "columns": 2,
+         "gutter": 18, "margin": 36, "crop_marks": true, "copies": 1}
+
+    Lengths are in PDF points. Tickets are scaled down (never up) to fit a cell.
+    """
+
+    def __init__(self, options):
+        if options is None:
+            options = {}
+        if not isinstance(options, dict):
+            raise TypeError("'imposition' must be a JSON object.")
+        sheet = str(options.get("sheet", "letter")).lower()
+        if sheet not in SHEET_SIZES:
+            raise ValueError(f"Unknown imposition sheet size: {sheet}")
+        width, height = SHEET_SIZES[sheet]
+        orientation = options.get("orientation", "portrait")
+        if orientation not in ("portrait", "landscape"):
+            raise ValueError(f"Unknown imposition orientation: {orientation}")
+        if orientation == "landscape":
+            width, height = height, width
+        self.sheet_width = width
+        self.sheet_height = height
+
+        self.rows = int(options.get("rows", 2))
+        self.columns = int(options.get("columns", 1))
+        self.copies = int(options.get("copies", 1))
+        self.gutter = float(options.get("gutter", 18))
+        self.margin = float(options.get("margin", 36))
+        self.crop_marks = bool(options.get("crop_marks", True))
+        if self.rows < 1 or self.columns < 1 or self.copies < 1:
+            raise ValueError("Imposition rows, columns and copies must be at least 1.")
+        if self.gutter < 0 or self.margin < 0:
+            raise ValueError("Imposition gutter and margin cannot be negative.")
+
+        self.cell_width = (
+            width - 2 * self.margin - (self.columns - 1) * self.gutter
+        ) / self.columns
+        self.cell_height = (
+            height - 2 * self.margin - (self.rows - 1) * self.gutter
+        ) / self.rows
+        if self.cell_width <= 0 or self.cell_height <= 0:
+            raise ValueError("Imposition margins and gutters leave no room for tickets.")
+
+    @property
+    def slots_per_sheet(self):
+        return self.rows * self.columns
+
+    def slot_rect(self, slot, ticket_width, ticket_height):
+        """Ticket rectangle for a slot (filled row by row from the top left), centered in its cell."""
+        row, column = divmod(slot, self.columns)
+        scale = min(self.cell_width / ticket_width, self.cell_height / ticket_height, 1.0)
+        width = ticket_width * scale
+        height = ticket_height * scale
+        cell_left = self.margin + column * (self.cell_width + self.gutter)
+        cell_top = self.sheet_height - self.margin - row * (self.cell_height + self.gutter)
+        left = cell_left + (self.cell_width - width) / 2
+        bottom = cell_top - self.cell_height + (self.cell_height - height) / 2
+        return Rectangle(left, bottom, left + width, bottom + height)
+
+
+def impose_pdf(pdf_bytes, layout):
+    """
+    Places every page of 'pdf_bytes' (one ticket per page, e.g. a combined
+    render) onto sheets according to 'layout' and returns the new PDF.
+
+    Each ticket page is converted to a Form XObject once and then placed by
+    reference, 'copies' times, so it is never re-laid-out or duplicated.
+    """
+    source = pikepdf.Pdf.open(io.BytesIO(pdf_bytes))
+    output = pikepdf.Pdf.new()
+    forms = [output.copy_foreign(page.as_form_xobject()) for page in source.pages]
+    sizes = [
+        (float(box[2]) - float(box[0]), float(box[3]) - float(box[1]))
+        for box in (page.mediabox for page in source.pages)
+    ]
+
+    placements = [index for index in range(len(forms)) for _ in range(layout.copies)]
+    for start in range(0, len(placements), layout.slots_per_sheet):
+        sheet = output.add_blank_page(page_size=(layout.sheet_width, layout.sheet_height))
+        operators = []
+        names = {}
+        for slot, index in enumerate(placements[start:start + layout.slots_per_sheet]):
+            rect = layout.slot_rect(slot, *sizes[index])
+            name = names.get(index)
+            if name is None:
+                # Named after the ticket: a prefix would get a random suffix, and
+                # the output would differ from run to run
+                name = names[index] = sheet.add_resource(forms[index], Name.XObject, Name(f"/Tk{index}"))
+            operators.append(sheet.calc_form_xobject_placement(forms[index], name, rect))
+            if layout.crop_marks:
+                operators.append(_crop_marks(rect))
+        sheet.obj.Contents = output.make_stream(b"\n".join(operators))
+
+    buffer = io.BytesIO()
+    # Content-derived /ID: the same tickets and layout always give the same bytes
+    output.save(buffer, deterministic_id=True)
+    return buffer.getvalue()
+
+
+def _crop_marks(rect):
+    # Short hairlines just outside each corner of the trimmed ticket
+    lines = []
+    for x, dx in ((rect.llx, -1), (rect.urx, 1)):
+        for y, dy in ((rect.lly, -1), (rect.ury, 1)):
+            start_x = x + dx * CROP_MARK_OFFSET
+            start_y = y + dy * CROP_MARK_OFFSET
+            end_x = x + dx * (CROP_MARK_OFFSET + CROP_MARK_LENGTH)
+            end_y = y + dy * (CROP_MARK_OFFSET + CROP_MARK_LENGTH)
+            lines.append(f"{start_x:.2f} {y:.2f} m {end_x:.2f} {y:.2f} l S")
+            lines.append(f"{x:.2f} {start_y:.2f} m {x:.2f} {end_y:.2f} l S")
+    return ("q 0.25 w 0 G\n" + "\n".join(lines) + "\nQ").encode("ascii")
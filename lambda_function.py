@@ -1,28 +1,667 @@
+import itertools
 import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 import boto3
-import base64
-from weasyprint import HTML, CSS
 import logging  # <-- NEW IMPORT
+from urllib.parse import unquote_plus
+from checkpoint import CheckpointStore, TimeBudget
+from coordinator import (
+    InProcessInvoker,
+    JobStore,
+    LambdaInvoker,
+    StepFunctionsInvoker,
+    chunk_size_for,
+    start_job,
+)
+from font_bundle import OfflineFontFetcher
+from imposition import ImpositionLayout, impose_pdf
+from manifest import iter_manifest_rows, manifest_settings, map_row
+from memory_usage import MemoryWatermark
+from metrics import InvocationMetrics, take_cold_start
+from profiling import InvocationProfiler
+from render_context import (
+    CachingURLFetcher,
+    RenderContext,
+    RenderTimings,
+    w3c_date,
+    with_document_date,
+)
+from render_pool import RenderPool, available_cpus
+from responses import (
+    MAX_RESPONSE_BYTES,
+    RESPONSE_MODES,
+    binary_response,
+    fits_in_response,
+    inline_response,
+    presigned_url,
+    redirect_response,
+    url_response,
+)
+from result_cache import RenderResultCache, render_cache_key
+from s3_fetcher import S3URLFetcher
+from s3_upload import S3MultipartWriter, S3SpooledWriter
+from structured_logging import Lazy, RequestLogging
+from template_cache import TemplateCache
+from template_renderer import get_compiled_template
+from ticket_archive import StreamingTicketArchive
 
-# Configure the logger
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+# Configure the logger: one JSON object per line. Payloads and HTML are only
+# logged at DEBUG, truncated to LOG_BODY_MAX_CHARS; LOG_SAMPLE_RATE of requests
+# (picked by request id) run at DEBUG so their full detail is kept. The modules
+# of this function log to "ticket_pdf"; only that logger goes to DEBUG.
+logger = logging.getLogger("ticket_pdf")
+request_logging = RequestLogging(
+    logger,
+    level=os.environ.get("LOG_LEVEL", "INFO"),
+    sample_rate=float(os.environ.get("LOG_SAMPLE_RATE", 0.01)),
+    max_body_chars=int(os.environ.get("LOG_BODY_MAX_CHARS", 2048)),
+)
+request_logging.install()
+
+# One CloudWatch EMF line per lambda_handler invocation with per-phase durations
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() == "true"
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "TicketPdf")
 
 # Initialize the S3 client outside the handler for better performance
 s3_client = boto3.client("s3")
 
+# On-demand profiling (see profiling.py): PROFILER=cprofile|pyinstrument profiles
+# every invocation, PROFILE_SIGNING_KEY accepts signed per-request "profile" flags.
+# Profiles go to PROFILE_OUTPUT, an s3://bucket/prefix/ or a local directory.
+invocation_profiler = InvocationProfiler(
+    profiler=os.environ.get("PROFILER"),
+    signing_key=os.environ.get("PROFILE_SIGNING_KEY"),
+    output=os.environ.get("PROFILE_OUTPUT", "/tmp/profiles"),
+    s3_client=s3_client,
+)
+
 # --- READ ENVIRONMENT VARIABLE ---
 S3_BUCKET_NAME = os.environ.get("S3_BUCKET_NAME")
 
+# --- TEMPLATE CACHE (lives across warm invocations) ---
+# Templates younger than the TTL are served with zero S3 round-trips; older ones
+# are revalidated with a conditional GET on the stored ETag.
+TEMPLATE_CACHE_MAX_BYTES = int(os.environ.get("TEMPLATE_CACHE_MAX_BYTES", 8 * 1024 * 1024))
+TEMPLATE_CACHE_TTL_SECONDS = float(os.environ.get("TEMPLATE_CACHE_TTL_SECONDS", 60))
+template_cache = TemplateCache(
+    max_bytes=TEMPLATE_CACHE_MAX_BYTES, ttl_seconds=TEMPLATE_CACHE_TTL_SECONDS
+)
+
+# --- RENDER CONTEXT (shared FontConfiguration, parsed CSS and url fetcher) ---
+# Created at init time so fonts, stylesheets and fetched resources are reused
+# by every render in this container instead of being rebuilt per request.
+# Google Fonts URLs are answered from the font bundle vendored into the image,
+# and s3:// assets (logos, shared CSS) go through s3_client with memory + /tmp caching.
+S3_ASSET_CACHE_DIR = os.environ.get("S3_ASSET_CACHE_DIR", "/tmp/s3-assets")
+S3_ASSET_CACHE_MAX_BYTES = int(os.environ.get("S3_ASSET_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+S3_ASSET_CACHE_TTL_SECONDS = float(os.environ.get("S3_ASSET_CACHE_TTL_SECONDS", 60))
+s3_url_fetcher = S3URLFetcher(
+    s3_client,
+    fallback=CachingURLFetcher(OfflineFontFetcher()),
+    cache_dir=S3_ASSET_CACHE_DIR,
+    max_memory_bytes=S3_ASSET_CACHE_MAX_BYTES,
+    ttl_seconds=S3_ASSET_CACHE_TTL_SECONDS,
+)
+# Deterministic output: metadata dates are pinned (see document_date_for) and the
+# PDF /ID is derived from the content, so identical inputs give identical bytes.
+DETERMINISTIC_PDF = os.environ.get("DETERMINISTIC_PDF", "true").lower() == "true"
+render_context = RenderContext(url_fetcher=s3_url_fetcher, deterministic=DETERMINISTIC_PDF)
+
+
+def prepare_substitutions(variable_substitutions, background_color, font_color):
+    """
+    Applies the color and breakfast conventions shared by every ticket and returns
+    the final substitution map (the caller's dict is left untouched).
+    """
+    variable_substitutions = dict(variable_substitutions)
+    variable_substitutions["background_color"] = background_color
+    variable_substitutions["font_color"] = font_color
+    # Use .pop() to extract it and remove it from the main substitutions list if found.
+    breakfast_required = variable_substitutions.pop("breakfast", False)
+    logger.debug("breakfast_required: %s", breakfast_required)
+    # If breakfast_required is True, set the substitution to 'B', otherwise set it to an empty string ''
+    # We add this new indicator to the substitution dictionary.
+    variable_substitutions["breakfast_indicator"] = "B" if breakfast_required else ""
+    return variable_substitutions
+
+
+def longest_value_chars(variable_substitutions):
+    """Length of the longest substitution value (e.g. a guest name) in one ticket or a batch."""
+    items = variable_substitutions if isinstance(variable_substitutions, list) else [variable_substitutions]
+    return max(
+        (len(str(value)) for item in items if isinstance(item, dict) for value in item.values()),
+        default=0,
+    )
+
+
+def document_date_for(template_entry, requested_date=None):
+    """
+    The creation/modification date written into a ticket in deterministic mode:
+    the 'document_date' sent with the request (ISO 8601), else the template's
+    LastModified, so the date only changes when the template does. Returns None
+    when deterministic output is off or no date is known (WeasyPrint then writes
+    no dates at all). Raises ValueError for an unparseable requested date.
+    """
+    if not DETERMINISTIC_PDF:
+        return None
+    if requested_date:
+        return w3c_date(requested_date)
+    if template_entry.last_modified:
+        return w3c_date(template_entry.last_modified)
+    return None
+
+
+def substitute_ticket_html(template_entry, variable_substitutions, document_date=None):
+    """
+    Substitutes the variables into the (cached, compiled) template and pins the
+    document date, if given. Returns (html_content, missing, unused).
+    """
+    logger.debug(
+        "Performing variable substitutions: %s", request_logging.body(variable_substitutions)
+    )
+    compiled_template = get_compiled_template(template_entry)
+    html_content, missing_variables, unused_variables = compiled_template.render(
+        variable_substitutions
+    )
+    if missing_variables:
+        logger.warning(
+            "Template placeholders without a value (left as-is): %s", missing_variables
+        )
+    if unused_variables:
+        logger.info("Variables not used by the template: %s", unused_variables)
+    if document_date:
+        html_content = with_document_date(html_content, document_date)
+    logger.debug(
+        "Variable substitution complete, html_content = %s", request_logging.body(html_content)
+    )  # <-- LOG: Completion of substitution
+    return html_content, missing_variables, unused_variables
+
+
+def render_html_pdf(html_content, base_url, target=None, timings=None):
+    """
+    Renders substituted ticket HTML with the shared render context, returning
+    the PDF bytes or, given a 'target' file object, writing them there.
+    A RenderTimings passed as 'timings' collects the time of each step.
+    """
+    logger.info("Starting PDF generation using WeasyPrint with base_url: %s", base_url)
+    # Pull every s3:// asset the ticket references in parallel up front
+    if timings is not None:
+        timings.start("AssetPrefetch")
+    for asset_url, error in s3_url_fetcher.prefetch(html_content, base_url):
+        if error:
+            logger.warning("Could not prefetch template asset %s: %s", asset_url, error)
+    return render_context.write_pdf(html_content, base_url, target, timings)
+
+
+def _reset_worker_clients():
+    # boto3 clients are not fork-safe: give each render worker its own
+    s3_url_fetcher.s3_client = boto3.client("s3")
+
+
+# --- RENDER RESULT CACHE (content-addressed PDFs in /tmp and S3) ---
+# Identical tickets (same template version, substitutions and options) are served
+# from the cache instead of being rendered again. Send "bypass_cache": true to skip it.
+RENDER_CACHE_ENABLED = os.environ.get("RENDER_CACHE_ENABLED", "true").lower() == "true"
+RENDER_CACHE_PREFIX = os.environ.get("RENDER_CACHE_PREFIX", "render-cache/")
+RENDER_CACHE_DIR = os.environ.get("RENDER_CACHE_DIR", "/tmp/render-cache")
+RENDER_CACHE_MAX_BYTES = int(os.environ.get("RENDER_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+render_result_cache = RenderResultCache(
+    s3_client,
+    S3_BUCKET_NAME,
+    prefix=RENDER_CACHE_PREFIX,
+    cache_dir=RENDER_CACHE_DIR,
+    max_local_bytes=RENDER_CACHE_MAX_BYTES,
+)
+
+# --- RESPONSE MODES (see responses.RESPONSE_MODES) ---
+# Requests pick one with "response_mode"; inline responses that would exceed the
+# synchronous payload limit are answered with a presigned URL instead.
+DEFAULT_RESPONSE_MODE = os.environ.get("DEFAULT_RESPONSE_MODE", "inline")
+PRESIGNED_URL_EXPIRES_SECONDS = int(os.environ.get("PRESIGNED_URL_EXPIRES_SECONDS", 3600))
+RESPONSE_MAX_BYTES = int(os.environ.get("RESPONSE_MAX_BYTES", MAX_RESPONSE_BYTES))
+
+# --- BACKGROUND UPLOADS ---
+# A single ticket's put_object runs here while its response is being encoded,
+# and the parts of streamed multipart uploads (large PDFs, archives) run here
+# while serialization continues; the handler joins them before returning.
+# Threads start lazily, after the render pool has forked.
+UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", 2))
+upload_executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="s3-upload")
+
+# --- ARCHIVE OUTPUT (streamed ZIP, multipart upload) ---
+ARCHIVE_PART_SIZE = int(os.environ.get("ARCHIVE_PART_SIZE", 8 * 1024 * 1024))
+
+# --- STREAMED PDF OUTPUT ---
+# Single tickets and combined PDFs are serialized straight into their S3 object:
+# spooled up to this size (then sent with one put_object), and past it uploaded
+# in multipart parts while WeasyPrint is still writing. Keep it above what fits
+# in an inline response, since streamed PDFs are only returned by URL.
+PDF_STREAM_THRESHOLD = int(os.environ.get("PDF_STREAM_THRESHOLD", 8 * 1024 * 1024))
+PDF_STREAM_PART_SIZE = int(os.environ.get("PDF_STREAM_PART_SIZE", 8 * 1024 * 1024))
+
+# --- RENDER POOL (multi-vCPU batch rendering) ---
+# Lambda allocates vCPUs in proportion to memory (see available_cpus). When more
+# than one full vCPU is available, batch renders fan out to worker processes forked
+# here, after every import above, so WeasyPrint is already loaded in each child.
+RENDER_POOL_SIZE = int(os.environ.get("RENDER_POOL_SIZE", 0)) or available_cpus()
+render_pool = RenderPool(
+    render_html_pdf, size=RENDER_POOL_SIZE, initializer=_reset_worker_clients
+)
+if RENDER_POOL_SIZE > 1:
+    render_pool.start()
+
+# --- MEMORY METRICS (peak RSS per phase, for right-sizing; see memory_report.py) ---
+# MEMORY_TRACE_TOP > 0 also runs tracemalloc and reports that many top allocators;
+# it slows every allocation down, so only turn it on while investigating.
+MEMORY_METRICS_ENABLED = os.environ.get("MEMORY_METRICS_ENABLED", "true").lower() == "true"
+MEMORY_TRACE_TOP = int(os.environ.get("MEMORY_TRACE_TOP", 0))
+memory_watermark = (
+    MemoryWatermark(worker_pids=render_pool.pids, trace_top=MEMORY_TRACE_TOP)
+    if MEMORY_METRICS_ENABLED
+    else None
+)
+
+# --- MANIFEST INGESTION ---
+# Results manifests are written under their own prefix so they never match the
+# bucket notification that triggers manifest_handler.
+MANIFEST_RESULTS_PREFIX = os.environ.get("MANIFEST_RESULTS_PREFIX", "manifest-results/")
+# Rows rendered per round; a few per pool worker keeps every vCPU busy
+MANIFEST_CHUNK_SIZE = int(os.environ.get("MANIFEST_CHUNK_SIZE", 0)) or 4 * RENDER_POOL_SIZE
+# The results file only appears once the whole manifest is done, so a progress
+# object next to it is rewritten after every chunk, listing up to this many failures
+MANIFEST_PROGRESS_MAX_FAILURES = int(os.environ.get("MANIFEST_PROGRESS_MAX_FAILURES", 100))
+
+# --- CHECKPOINT / RESUME ---
+# A resumable batch stops this long before the invocation deadline (plus the
+# longest round so far), saves its cursor to S3 and returns a continuation token.
+CHECKPOINTS_PREFIX = os.environ.get("CHECKPOINTS_PREFIX", "checkpoints/")
+CHECKPOINT_RESERVE_MS = int(os.environ.get("CHECKPOINT_RESERVE_MS", 10000))
+RESUMABLE_ROUND_SIZE = int(os.environ.get("RESUMABLE_ROUND_SIZE", 0)) or max(4, 2 * RENDER_POOL_SIZE)
+checkpoint_store = CheckpointStore(s3_client, S3_BUCKET_NAME, CHECKPOINTS_PREFIX)
+
+# --- FAN-OUT COORDINATOR ---
+# Jobs too big for one invocation are split into chunks, each rendered by its own
+# worker invocation. COORDINATOR_INVOKER picks how chunks are dispatched:
+# 'lambda' (async invoke of CHUNK_WORKER_FUNCTION_NAME), 'stepfunctions' (a
+# Distributed Map in CHUNK_STATE_MACHINE_ARN) or 'inprocess' (local runs).
+JOBS_PREFIX = os.environ.get("JOBS_PREFIX", "jobs/")
+COORDINATOR_INVOKER = os.environ.get("COORDINATOR_INVOKER", "lambda")
+CHUNK_WORKER_FUNCTION_NAME = os.environ.get("CHUNK_WORKER_FUNCTION_NAME")
+CHUNK_STATE_MACHINE_ARN = os.environ.get("CHUNK_STATE_MACHINE_ARN")
+# Chunk sizing: as many tickets as should render in the target time, capped
+COORDINATOR_SECONDS_PER_TICKET = float(os.environ.get("COORDINATOR_SECONDS_PER_TICKET", 0.5))
+COORDINATOR_TARGET_CHUNK_SECONDS = float(os.environ.get("COORDINATOR_TARGET_CHUNK_SECONDS", 300))
+COORDINATOR_MAX_CHUNK_SIZE = int(os.environ.get("COORDINATOR_MAX_CHUNK_SIZE", 1000))
+
+
+def prepare_batch(bucket, template_entry, event_name, items, defaults, background_color, font_color, per_item_keys=True, seen_keys=None):
+    """
+    Substitutes every batch item into the template. Each item is a
+    variableSubstitutions dict; 'user', 'pdf_filename' and 'document_date' may be
+    given per item and otherwise come from 'defaults' ('user' and 'pdf_filename'
+    are only required when 'per_item_keys' is set, i.e. when every ticket is
+    uploaded on its own). Without 'per_item_keys' the items become pages of one
+    PDF, so a per-item 'document_date' is ignored in favour of the default.
+
+    An item whose output key was already taken by an earlier item (e.g. both
+    fell back to the payload's 'user' and 'pdf_filename') fails instead of
+    overwriting it. 'seen_keys' carries the taken keys across calls for batches
+    prepared in several chunks.
+
+    Returns (results, jobs): a result dict per item, with failed items already
+    marked, and an (index, output_key, html_content) job per item that is ready
+    to render.
+    """
+    results = [{"index": index} for index in range(len(items))]
+    jobs = []
+    seen_keys = set() if seen_keys is None else seen_keys
+    for index, item in enumerate(items):
+        result = results[index]
+        try:
+            item = dict(item)
+            user = item.pop("user", None) or defaults.get("user")
+            pdf_filename = item.pop("pdf_filename", None) or defaults.get("pdf_filename")
+            item_date = item.pop("document_date", None)
+            if not per_item_keys:
+                # One output document: its pages share one <head>, so only the
+                # batch-level date applies
+                item_date = None
+            document_date = document_date_for(
+                template_entry, item_date or defaults.get("document_date")
+            )
+            output_key = None
+            if per_item_keys:
+                if not user:
+                    raise KeyError("user")
+                if not pdf_filename:
+                    raise KeyError("pdf_filename")
+                output_key = f"{event_name}/{user}/{pdf_filename}"
+                if output_key in seen_keys:
+                    raise ValueError(
+                        f"Duplicate output key {output_key}: give every item its own 'user' or 'pdf_filename'."
+                    )
+                seen_keys.add(output_key)
+                result["s3_path"] = f"s3://{bucket}/{output_key}"
+
+            variable_substitutions = prepare_substitutions(item, background_color, font_color)
+            html_content, missing_variables, _ = substitute_ticket_html(
+                template_entry, variable_substitutions, document_date
+            )
+            result["missing_variables"] = missing_variables
+            jobs.append((index, output_key, html_content))
+        except KeyError as e:
+            logger.error("Batch item %s: missing required field %s", index, e)
+            result.update(status="failed", error=f"Missing required field: {e}")
+        except Exception as e:
+            logger.error("Batch item %s failed: %s", index, e, exc_info=True)
+            result.update(status="failed", error=str(e))
+    return results, jobs
+
+
+def render_batch(bucket, template_entry, event_name, items, defaults, background_color, font_color, seen_keys=None):
+    """
+    Renders and uploads one ticket per item, reusing the fetched template and the
+    render context. A failing item is reported in its result and does not stop
+    the batch.
+
+    Substitution and uploads happen in this process; rendering is fanned out to
+    the render pool when it is running.
+    """
+    base_url = f"s3://{bucket}/"
+    results, jobs = prepare_batch(
+        bucket,
+        template_entry,
+        event_name,
+        items,
+        defaults,
+        background_color,
+        font_color,
+        seen_keys=seen_keys,
+    )
+
+    upload_rendered_jobs(bucket, jobs, results, base_url)
+    return results
 
+
+def upload_rendered_jobs(bucket, jobs, results, base_url):
+    """
+    Renders prepared jobs and uploads each PDF to its output key as soon as it is
+    ready, recording success or failure on results[index].
+    """
+    output_keys = {index: output_key for index, output_key, _ in jobs}
+    for index, ok, value in render_jobs(jobs, base_url):
+        result = results[index]
+        if not ok:
+            logger.error("Batch item %s failed to render: %s", index, value)
+            result.update(status="failed", error=value)
+            continue
+        try:
+            s3_client.put_object(
+                Bucket=bucket,
+                Key=output_keys[index],
+                Body=value,
+                ContentType="application/pdf",
+            )
+            result.update(status="succeeded", size=len(value))
+        except Exception as e:
+            logger.error("Batch item %s failed to upload: %s", index, e, exc_info=True)
+            result.update(status="failed", error=str(e))
+
+
+def render_resumable_batch(bucket, template_entry, token, state, budget):
+    """
+    Renders a batch (output_mode 'separate') in rounds of RESUMABLE_ROUND_SIZE,
+    checking the time budget before each round. If the invocation is about to
+    run out of time, the cursor and the keys completed so far are saved as a
+    checkpoint and a 202 response with the continuation token is returned;
+    sending {"continuation_token": ...} resumes from the cursor.
+    Returns the API response.
+    """
+    payload = state["payload"]
+    items = payload["variableSubstitutions"]
+    # Keys written by earlier rounds / invocations, so later items cannot reuse them
+    seen_keys = {s3_path[len(f"s3://{bucket}/"):] for s3_path in state["completed"]}
+    while state["cursor"] < len(items):
+        if budget.exhausted():
+            state["checkpointed"] = True
+            checkpoint_store.save(token, state)
+            logger.info(
+                "Checkpointed batch %s at item %s of %s (%s ms left).",
+                token,
+                state['cursor'],
+                len(items),
+                budget.remaining_ms(),
+            )
+            return {
+                "statusCode": 202,
+                "headers": {"Content-Type": "application/json"},
+                "body": json.dumps(
+                    {
+                        "message": "Batch paused before the invocation timeout; resend the continuation token to resume.",
+                        "continuation_token": token,
+                        "cursor": state["cursor"],
+                        "total": len(items),
+                        "succeeded": len(state["completed"]),
+                        "failed": len(state["failures"]),
+                    }
+                ),
+            }
+
+        round_start = time.monotonic()
+        cursor = state["cursor"]
+        results = render_batch(
+            bucket,
+            template_entry,
+            payload["eventName"],
+            items[cursor:cursor + RESUMABLE_ROUND_SIZE],
+            defaults=payload,
+            background_color=payload.get("background_color", "white"),
+            font_color=payload.get("font_color", "black"),
+            seen_keys=seen_keys,
+        )
+        for result in results:
+            if result["status"] == "succeeded":
+                state["completed"].append(result["s3_path"])
+            else:
+                state["failures"].append(
+                    {"index": cursor + result["index"], "error": result["error"]}
+                )
+        state["cursor"] = cursor + len(results)
+        budget.record_round(time.monotonic() - round_start)
+
+    # Finished: a checkpoint left by an earlier invocation is no longer needed
+    if state.get("checkpointed"):
+        try:
+            checkpoint_store.delete(token)
+        except Exception as e:
+            logger.warning("Could not delete checkpoint %s: %s", token, e)
+    logger.info(
+        "Resumable batch %s complete: %s succeeded, %s failed.",
+        token,
+        len(state['completed']),
+        len(state['failures']),
+    )
+    return {
+        "statusCode": 200,
+        "headers": {"Content-Type": "application/json"},
+        "body": json.dumps(
+            {
+                "message": "Batch processed.",
+                "succeeded": len(state["completed"]),
+                "failed": len(state["failures"]),
+                "completed": state["completed"],
+                "failures": state["failures"],
+            }
+        ),
+    }
+
+
+def render_archive(bucket, template_entry, event_name, items, defaults, background_color, font_color, archive_key):
+    """
+    Renders every item and streams each finished PDF into a ZIP archive that is
+    uploaded to 'archive_key' with a multipart upload as parts fill, so memory
+    stays bounded by the part size regardless of the guest count. Members are
+    named '{user}/{pdf_filename}'. A JSON index of member offsets is written to
+    '{archive_key}.index.json' for single-ticket range GETs.
+    Returns (results, archive_size).
+    """
+    base_url = f"s3://{bucket}/"
+    results, jobs = prepare_batch(
+        bucket, template_entry, event_name, items, defaults, background_color, font_color
+    )
+    member_names = {
+        index: output_key[len(event_name) + 1:] for index, output_key, _ in jobs
+    }
+
+    with S3MultipartWriter(
+        s3_client,
+        bucket,
+        archive_key,
+        part_size=ARCHIVE_PART_SIZE,
+        content_type="application/zip",
+        executor=upload_executor,
+    ) as writer:
+        archive = StreamingTicketArchive(writer)
+        for index, ok, value in render_jobs(jobs, base_url):
+            result = results[index]
+            # Tickets live inside the archive, not as objects of their own
+            result.pop("s3_path", None)
+            if not ok:
+                logger.error("Batch item %s failed to render: %s", index, value)
+                result.update(status="failed", error=value)
+                continue
+            archive.add(member_names[index], value, index=index)
+            result.update(status="succeeded", member=member_names[index], size=len(value))
+        archive.close()
+
+    archive_url = f"s3://{bucket}/{archive_key}"
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=f"{archive_key}.index.json",
+        Body=json.dumps(archive.index(archive_url)).encode("utf-8"),
+        ContentType="application/json",
+    )
+    return results, writer.tell()
+
+
+def render_combined(bucket, template_entry, event_name, items, defaults, background_color, font_color, target=None):
+    """
+    Renders every item as one page of a single PDF in one WeasyPrint layout pass,
+    so fonts are embedded and subset once for the whole guest list.
+    Returns (results, pdf_bytes); pdf_bytes is None if no item could be prepared,
+    or if the PDF was written to 'target' (a file object) instead.
+    """
+    base_url = f"s3://{bucket}/"
+    results, jobs = prepare_batch(
+        bucket,
+        template_entry,
+        event_name,
+        items,
+        defaults,
+        background_color,
+        font_color,
+        per_item_keys=False,
+    )
+    if not jobs:
+        return results, None
+
+    html_documents = [html_content for _, _, html_content in jobs]
+    for asset_url, error in s3_url_fetcher.prefetch(html_documents[0], base_url):
+        if error:
+            logger.warning("Could not prefetch template asset %s: %s", asset_url, error)
+    pdf_bytes = render_context.write_combined_pdf(html_documents, base_url, target)
+    for page_number, (index, _, _) in enumerate(jobs, start=1):
+        results[index].update(status="succeeded", page=page_number)
+    return results, pdf_bytes
+
+
+def ticket_response(response_mode, response_fields, pdf_bytes, pdf_size, bucket, key, pdf_filename):
+    """
+    Builds the API response for a single ticket in 'response_mode' (see
+    responses.RESPONSE_MODES). pdf_bytes is None when the PDF was streamed to S3,
+    in which case, like for PDFs too large for a Lambda response, it is returned
+    by presigned URL.
+    """
+    fits = pdf_bytes is not None and fits_in_response(pdf_size, RESPONSE_MAX_BYTES)
+    if response_mode == "binary" and fits:
+        logger.info("Returning the PDF as a binary response.")
+        return binary_response(
+            pdf_bytes, pdf_filename, {"X-S3-Path": response_fields["s3_path"]}
+        )
+    if response_mode == "inline" and fits:
+        # The Base64 string is included, but we don't log the massive string itself.
+        logger.info("Returning the PDF inline as Base64.")
+        return inline_response(response_fields, pdf_bytes)
+
+    if response_mode != "url":
+        logger.info(
+            "PDF too large for a %s response (%s bytes), returning a presigned URL.",
+            response_mode,
+            pdf_size,
+        )
+    pdf_url = presigned_url(s3_client, bucket, key, PRESIGNED_URL_EXPIRES_SECONDS)
+    if response_mode == "binary":
+        return redirect_response(pdf_url, {"X-S3-Path": response_fields["s3_path"]})
+    return url_response(response_fields, pdf_url, PRESIGNED_URL_EXPIRES_SECONDS)
+
+
+def render_jobs(jobs, base_url):
+    """
+    Renders prepared (index, output_key, html_content) jobs and yields
+    (index, ok, pdf_bytes_or_error) as each one finishes, on the render pool
+    when it is running and in this process otherwise.
+    """
+    if render_pool.started and len(jobs) > 1:
+        for job_id, ok, value in render_pool.imap_unordered(
+            [(html_content, base_url) for _, _, html_content in jobs]
+        ):
+            yield jobs[job_id][0], ok, value
+    else:
+        for index, _, html_content in jobs:
+            yield _render_inline(index, html_content, base_url)
+
+
+def _render_inline(index, html_content, base_url):
+    try:
+        return index, True, render_html_pdf(html_content, base_url)
+    except Exception as e:
+        logger.error("Batch item %s failed to render: %s", index, e, exc_info=True)
+        return index, False, str(e)
+
+
+@request_logging.handler
+@invocation_profiler.handler
 def lambda_handler(event, context):
     """
     Generates a PDF, saves a copy to S3 with a path derived from 'eventName' and 'user',
-    Base64-encodes the content, and returns the Base64 string in a JSON payload.
+    and returns it according to "response_mode": Base64 in a JSON payload ('inline',
+    the default; a presigned URL instead when the PDF is too large for a Lambda
+    response), a presigned URL only ('url'), or the PDF itself for API Gateway
+    binary media types ('binary').
+
+    If 'variableSubstitutions' is a list, every entry is rendered as its own ticket
+    (sharing eventName, template_s3_key and colors) and per-item results are returned.
+    With "output_mode": "combined" the whole list becomes one PDF, one page per ticket,
+    "imposed" places those pages N-up on print sheets (see ImpositionLayout), and
+    "archive" streams every ticket into '{eventName}/{archive_filename}' as a ZIP.
+    A batch sent with "resumable": true checkpoints itself before the invocation
+    times out and returns a continuation_token to resume it with.
+
+    An optional "document_date" (ISO 8601) sets the PDF creation/modification
+    dates; without it the template's LastModified is used, so repeating a request
+    yields a byte-identical PDF (see DETERMINISTIC_PDF).
+
+    A "profile" flag signed with PROFILE_SIGNING_KEY runs the invocation under a
+    profiler (see profiling.py); it does not change the response.
     """
     logger.info("--- STARTING PDF GENERATION PROCESS ---")
-    logger.info(f"Received event payload: {event}")  # <-- LOG: Full incoming payload
+    metrics = InvocationMetrics(
+        METRICS_NAMESPACE, "lambda_handler", take_cold_start(), memory=memory_watermark
+    )
+    metrics.set_property("MemoryLimitMB", getattr(context, "memory_limit_in_mb", None))
 
     if not S3_BUCKET_NAME:
         logger.error("Lambda environment variable S3_BUCKET_NAME is not set.")
@@ -34,9 +673,10 @@ def lambda_handler(event, context):
         }
 
     BUCKET = S3_BUCKET_NAME
-    logger.info(f"Using S3 Bucket: {BUCKET}")  # <-- LOG: S3 Bucket Name
+    logger.info("Using S3 Bucket: %s", BUCKET)  # <-- LOG: S3 Bucket Name
 
     try:
+        metrics.start_phase("ParseRequest")
         if "body" in event and event["body"] is not None:
             # The body comes as a JSON string, so we must parse it into a Python dict
             payload = json.loads(event["body"])
@@ -44,17 +684,28 @@ def lambda_handler(event, context):
             # Handle cases where the body might be empty or missing
             raise KeyError("Request body is empty or missing in the event.")
 
-        logger.info(f"Successfully parsed request payload: {payload.keys()}")
+        logger.info("Successfully parsed request payload: %s", payload.keys())
+
+        # --- RESUME: a continuation token picks a paused batch back up ---
+        checkpoint_token = payload.get("continuation_token")
+        checkpoint_state = None
+        if checkpoint_token is not None:
+            try:
+                checkpoint_state = checkpoint_store.load(checkpoint_token)
+            except ValueError as e:
+                return {"statusCode": 400, "body": json.dumps({"error": str(e)})}
+            except LookupError as e:
+                return {"statusCode": 404, "body": json.dumps({"error": str(e)})}
+            payload = checkpoint_state["payload"]
+            logger.info(
+                "Resuming batch %s at item %s", checkpoint_token, checkpoint_state['cursor']
+            )
+
         # --- 1. Define Input Parameters (FIXED) ---
 
         # Required inputs for dynamic folder name
         # FIX: Access payload instead of event
         EVENT_NAME = payload["eventName"]
-        USER = payload["user"]
-
-        # Filename input property
-        # FIX: Access payload instead of event
-        PDF_FILENAME = payload["pdf_filename"]
 
         # Other required and optional inputs
         # FIX: Access payload instead of event
@@ -67,9 +718,190 @@ def lambda_handler(event, context):
         BACKGROUND_COLOR = payload.get("background_color", "white")
         # Get font color or default to black (NEW)
         FONT_COLOR = payload.get("font_color", "black")
+        logger.debug("BACKGROUND_COLOR: %s", BACKGROUND_COLOR)
+        logger.debug("FONT_COLOR: %s", FONT_COLOR)
+        metrics.set_property("TemplateKey", TEMPLATE_KEY)
+        metrics.put_metric("LongestValueChars", longest_value_chars(variable_substitutions), "Count")
+
+        # --- BATCH MODE: a list of variableSubstitutions renders many tickets ---
+        if isinstance(variable_substitutions, list):
+            logger.info(
+                "Batch request: %s tickets for EventName=%s, TemplateKey=%s",
+                len(variable_substitutions),
+                EVENT_NAME,
+                TEMPLATE_KEY,
+            )
+            metrics.set_property("Mode", "batch")
+            metrics.put_metric("Tickets", len(variable_substitutions), "Count")
+            metrics.start_phase("TemplateFetch")
+            template_entry, cache_outcome = template_cache.get(
+                s3_client, BUCKET, TEMPLATE_KEY
+            )
+            metrics.set_property("TemplateCache", cache_outcome)
+            logger.info(
+                "Template cache %s (ETag=%s), stats: %s",
+                cache_outcome,
+                template_entry.etag,
+                Lazy(template_cache.stats),
+            )
+            # 'separate' (default): one PDF per ticket; 'combined': one PDF, one page per ticket;
+            # 'imposed': the combined pages placed N-up on print sheets with crop marks;
+            # 'archive': every ticket streamed into one ZIP in S3 plus a JSON offset index
+            OUTPUT_MODE = payload.get("output_mode", "separate")
+            metrics.set_property("OutputMode", OUTPUT_MODE)
+            metrics.start_phase("Batch")
+
+            # --- RESUMABLE BATCH: checkpoint to S3 before the invocation times out ---
+            if payload.get("resumable") or checkpoint_state is not None:
+                if OUTPUT_MODE != "separate":
+                    return {
+                        "statusCode": 400,
+                        "body": json.dumps(
+                            {"error": "Resumable batches only support output_mode 'separate'."}
+                        ),
+                    }
+                if checkpoint_state is None:
+                    checkpoint_token = checkpoint_store.new_token()
+                    checkpoint_state = {
+                        "payload": payload,
+                        "cursor": 0,
+                        "completed": [],
+                        "failures": [],
+                    }
+                return render_resumable_batch(
+                    BUCKET,
+                    template_entry,
+                    checkpoint_token,
+                    checkpoint_state,
+                    TimeBudget(context, CHECKPOINT_RESERVE_MS),
+                )
+
+            batch_response = {"message": "Batch processed."}
+            if OUTPUT_MODE in ("combined", "imposed"):
+                OUTPUT_KEY = f"{EVENT_NAME}/{payload['user']}/{payload['pdf_filename']}"
+                if OUTPUT_MODE == "imposed":
+                    # Validate the sheet layout before spending time on rendering
+                    try:
+                        imposition_layout = ImpositionLayout(payload.get("imposition", {}))
+                    except (TypeError, ValueError) as e:
+                        logger.error("Invalid imposition layout: %s", e)
+                        return {
+                            "statusCode": 400,
+                            "body": json.dumps({"error": f"Invalid imposition layout: {e}"}),
+                        }
+                    results, pdf_bytes = render_combined(
+                        BUCKET,
+                        template_entry,
+                        EVENT_NAME,
+                        variable_substitutions,
+                        defaults=payload,
+                        background_color=BACKGROUND_COLOR,
+                        font_color=FONT_COLOR,
+                    )
+                    if pdf_bytes is not None:
+                        pdf_bytes = impose_pdf(pdf_bytes, imposition_layout)
+                        s3_client.put_object(
+                            Bucket=BUCKET,
+                            Key=OUTPUT_KEY,
+                            Body=pdf_bytes,
+                            ContentType="application/pdf",
+                        )
+                        batch_response.update(
+                            s3_path=f"s3://{BUCKET}/{OUTPUT_KEY}", size=len(pdf_bytes)
+                        )
+                else:
+                    # The combined PDF is streamed into its S3 object as it is written
+                    with S3SpooledWriter(
+                        s3_client,
+                        BUCKET,
+                        OUTPUT_KEY,
+                        threshold=PDF_STREAM_THRESHOLD,
+                        part_size=PDF_STREAM_PART_SIZE,
+                        content_type="application/pdf",
+                        executor=upload_executor,
+                    ) as pdf_writer:
+                        results, _ = render_combined(
+                            BUCKET,
+                            template_entry,
+                            EVENT_NAME,
+                            variable_substitutions,
+                            defaults=payload,
+                            background_color=BACKGROUND_COLOR,
+                            font_color=FONT_COLOR,
+                            target=pdf_writer,
+                        )
+                    if pdf_writer.tell():
+                        batch_response.update(
+                            s3_path=f"s3://{BUCKET}/{OUTPUT_KEY}", size=pdf_writer.tell()
+                        )
+            elif OUTPUT_MODE == "archive":
+                ARCHIVE_KEY = f"{EVENT_NAME}/{payload.get('archive_filename', 'tickets.zip')}"
+                results, archive_size = render_archive(
+                    BUCKET,
+                    template_entry,
+                    EVENT_NAME,
+                    variable_substitutions,
+                    defaults=payload,
+                    background_color=BACKGROUND_COLOR,
+                    font_color=FONT_COLOR,
+                    archive_key=ARCHIVE_KEY,
+                )
+                batch_response.update(
+                    s3_path=f"s3://{BUCKET}/{ARCHIVE_KEY}",
+                    index_s3_path=f"s3://{BUCKET}/{ARCHIVE_KEY}.index.json",
+                    size=archive_size,
+                )
+            elif OUTPUT_MODE == "separate":
+                results = render_batch(
+                    BUCKET,
+                    template_entry,
+                    EVENT_NAME,
+                    variable_substitutions,
+                    defaults=payload,
+                    background_color=BACKGROUND_COLOR,
+                    font_color=FONT_COLOR,
+                )
+            else:
+                return {
+                    "statusCode": 400,
+                    "body": json.dumps({"error": f"Unknown output_mode: {OUTPUT_MODE}"}),
+                }
+            failed = sum(1 for result in results if result["status"] == "failed")
+            logger.info(
+                "Batch complete: %s succeeded, %s failed.", len(results) - failed, failed
+            )
+            batch_response.update(
+                succeeded=len(results) - failed, failed=failed, results=results
+            )
+            return {
+                "statusCode": 200,
+                "headers": {"Content-Type": "application/json"},
+                "body": json.dumps(batch_response),
+            }
+
+        USER = payload["user"]
+
+        # Filename input property
+        # FIX: Access payload instead of event
+        PDF_FILENAME = payload["pdf_filename"]
+
+        RESPONSE_MODE = payload.get("response_mode", DEFAULT_RESPONSE_MODE)
+        metrics.set_property("Mode", "single")
+        metrics.put_metric("Tickets", 1, "Count")
+        metrics.set_property("ResponseMode", RESPONSE_MODE)
+        if RESPONSE_MODE not in RESPONSE_MODES:
+            return {
+                "statusCode": 400,
+                "body": json.dumps({"error": f"Unknown response_mode: {RESPONSE_MODE}"}),
+            }
 
         logger.info(
-            f"Input details: EventName={EVENT_NAME}, User={USER}, Filename={PDF_FILENAME}, TemplateKey={TEMPLATE_KEY}, BackgroundColor={BACKGROUND_COLOR}"
+            "Input details: EventName=%s, User=%s, Filename=%s, TemplateKey=%s, BackgroundColor=%s",
+            EVENT_NAME,
+            USER,
+            PDF_FILENAME,
+            TEMPLATE_KEY,
+            BACKGROUND_COLOR,
         )
 
         # --- 2. Dynamically Construct Output Key Prefix ---
@@ -77,87 +909,510 @@ def lambda_handler(event, context):
         FINAL_OUTPUT_KEY = f"{OUTPUT_KEY_PREFIX}{PDF_FILENAME}"
 
         logger.info(
-            f"Determined full S3 output path (key): {FINAL_OUTPUT_KEY}"
+            "Determined full S3 output path (key): %s", FINAL_OUTPUT_KEY
         )  # <-- LOG: Full output key
 
         # --- 3. Fetch HTML Template & Inject Styling ---
         logger.info(
-            f"Fetching template from S3 Key: {TEMPLATE_KEY}"
+            "Fetching template from S3 Key: %s", TEMPLATE_KEY
         )  # <-- LOG: Template fetch initiation
-        s3_response = s3_client.get_object(Bucket=BUCKET, Key=TEMPLATE_KEY)
-        html_content = s3_response["Body"].read().decode("utf-8")
-
-        # --- 4. Dynamic Variable Replacement ---
-        variable_substitutions["background_color"] = BACKGROUND_COLOR
-        variable_substitutions["font_color"] = FONT_COLOR
-        # Use .pop() to extract it and remove it from the main substitutions list if found.
-        breakfast_required = variable_substitutions.pop("breakfast", False)
-        logger.info(f"breakfast_required: {breakfast_required}")
-        # If breakfast_required is True, set the substitution to 'B', otherwise set it to an empty string ''
-        # We add this new indicator to the substitution dictionary.
-        variable_substitutions["breakfast_indicator"] = (
-            "B" if breakfast_required else ""
+        metrics.start_phase("TemplateFetch")
+        template_entry, cache_outcome = template_cache.get(
+            s3_client, BUCKET, TEMPLATE_KEY
         )
-
-        logger.info(f"BACKGROUND_COLOR: {BACKGROUND_COLOR}")
-        logger.info(f"FONT_COLOR: {FONT_COLOR}")
+        metrics.set_property("TemplateCache", cache_outcome)
         logger.info(
-            f"Performing variable substitutions: {json.dumps(variable_substitutions)}"
+            "Template cache %s (ETag=%s), stats: %s",
+            cache_outcome,
+            template_entry.etag,
+            Lazy(template_cache.stats),
+        )  # <-- LOG: Template cache outcome and counters
+
+        # --- 4. Dynamic Variable Replacement ---
+        metrics.start_phase("Substitution")
+        variable_substitutions = prepare_substitutions(
+            variable_substitutions, BACKGROUND_COLOR, FONT_COLOR
         )
-        for key, value in variable_substitutions.items():
-            placeholder = f"{{ {key} }}"
-            html_content = html_content.replace(placeholder, str(value))
-        logger.info(
-            "Variable substitution complete, html_content = %s", html_content
-        )  # <-- LOG: Completion of substitution
+        try:
+            document_date = document_date_for(template_entry, payload.get("document_date"))
+        except (TypeError, ValueError) as e:
+            logger.error("Invalid document_date: %s", e)
+            return {
+                "statusCode": 400,
+                "body": json.dumps({"error": f"Invalid document_date: {e}"}),
+            }
 
-        # --- 5. Generate PDF BYTES ---
+        # --- 5. Generate PDF BYTES (or reuse an identical earlier render) ---
         base_url = f"s3://{BUCKET}/"
-        logger.info(
-            f"Starting PDF generation using WeasyPrint with base_url: {base_url}"
+        html_content, missing_variables, unused_variables = substitute_ticket_html(
+            template_entry, variable_substitutions, document_date
         )
-        pdf_bytes = HTML(string=html_content, base_url=base_url).write_pdf()
-
-        # --- 6. Save PDF to Target S3 Location ---
+        metrics.start_phase("RenderCacheLookup")
+        pdf_bytes = None
+        render_cache_tier = "disabled"
+        use_render_cache = RENDER_CACHE_ENABLED and template_entry.etag
+        if use_render_cache and payload.get("bypass_cache"):
+            render_result_cache.record_bypass()
+            render_cache_tier = "bypass"
+        elif use_render_cache:
+            cache_key = render_cache_key(
+                template_entry.etag,
+                variable_substitutions,
+                {"base_url": base_url, "document_date": document_date},
+            )
+            # The cache is only an optimisation: any failure reading it (e.g. a
+            # 403 for a missing key without s3:ListBucket) renders as on a miss
+            try:
+                render_cache_tier, pdf_bytes = render_result_cache.find(cache_key)
+                if render_cache_tier == "s3":
+                    pdf_bytes = render_result_cache.read_remote(cache_key)
+            except Exception as e:
+                logger.warning("Render cache lookup failed, rendering instead: %s", e)
+                render_result_cache.record_error()
+                render_cache_tier, pdf_bytes = "miss", None
         logger.info(
-            f"Uploading generated PDF (size: {len(pdf_bytes)} bytes) to S3..."
-        )  # <-- LOG: PDF size/upload
-        s3_client.put_object(
-            Bucket=BUCKET,
-            Key=FINAL_OUTPUT_KEY,
-            Body=pdf_bytes,
-            ContentType="application/pdf",
-        )
-        logger.info("PDF successfully uploaded to S3.")
+            "Render cache %s, stats: %s", render_cache_tier, Lazy(render_result_cache.stats)
+        )  # <-- LOG: Render result cache outcome and hit rate
+        metrics.set_property("RenderCache", render_cache_tier)
 
-        # --- 7. Base64 Encode and Return ---
-        pdf_base64_string = base64.b64encode(pdf_bytes).decode("utf-8")
+        # --- 6. Save PDF to Target S3 Location (in the background) ---
+        if pdf_bytes is None:
+            # Rendered straight into the output object (see PDF_STREAM_THRESHOLD);
+            # pdf_bytes stays None if the PDF was too large to keep in memory
+            metrics.start_phase("Render")
+            render_timings = RenderTimings()
+            with S3SpooledWriter(
+                s3_client,
+                BUCKET,
+                FINAL_OUTPUT_KEY,
+                threshold=PDF_STREAM_THRESHOLD,
+                part_size=PDF_STREAM_PART_SIZE,
+                content_type="application/pdf",
+                executor=upload_executor,
+            ) as pdf_writer:
+                render_html_pdf(
+                    html_content, base_url, target=pdf_writer, timings=render_timings
+                )
+            # Sub-phases of Render: RenderLayout, RenderSerialize, ...
+            for step, milliseconds in render_timings.phases.items():
+                metrics.add_phase(f"Render{step}", milliseconds)
+            pdf_bytes = pdf_writer.getvalue()
+            pdf_size = pdf_writer.tell()
+            pending_upload = pdf_writer.upload
+        else:
+            pdf_size = len(pdf_bytes)
+            pending_upload = upload_executor.submit(
+                s3_client.put_object,
+                Bucket=BUCKET,
+                Key=FINAL_OUTPUT_KEY,
+                Body=pdf_bytes,
+                ContentType="application/pdf",
+            )
 
-        logger.info(
-            "PDF Base64 encoding complete. Returning success response."
-        )  # <-- LOG: Final action
+        metrics.put_metric("PdfBytes", pdf_size, "Bytes")
 
-        return {
-            "statusCode": 200,
-            "headers": {"Content-Type": "application/json"},
-            "body": json.dumps(
+        # --- 7. Encode the response while the upload runs, then join it ---
+        metrics.start_phase("Encode")
+        try:
+            response = ticket_response(
+                RESPONSE_MODE,
                 {
                     "message": "PDF generated and uploaded successfully.",
                     "s3_path": f"s3://{BUCKET}/{FINAL_OUTPUT_KEY}",
-                    # The Base64 string is included, but we don't log the massive string itself.
-                    "pdf_base64": pdf_base64_string,
-                }
-            ),
-        }
+                    "missing_variables": missing_variables,
+                    "unused_variables": unused_variables,
+                    "render_cache": render_cache_tier,
+                },
+                pdf_bytes,
+                pdf_size,
+                BUCKET,
+                FINAL_OUTPUT_KEY,
+                PDF_FILENAME,
+            )
+        finally:
+            # Joined even if encoding failed, so the upload never outlives the invocation
+            metrics.start_phase("UploadWait")
+            upload_error = pending_upload.exception() if pending_upload else None
+            if upload_error is not None:
+                logger.error("Upload to s3://%s/%s failed: %s", BUCKET, FINAL_OUTPUT_KEY, upload_error)
+        if upload_error is not None:
+            raise upload_error
+        logger.info(
+            "PDF successfully uploaded to S3 (size: %s bytes).", pdf_size
+        )  # <-- LOG: PDF size/upload
+        if render_cache_tier == "miss":
+            # Server-side copy of the object just uploaded fills the S3 tier
+            metrics.start_phase("RenderCacheStore")
+            try:
+                render_result_cache.store(cache_key, pdf_bytes, source_key=FINAL_OUTPUT_KEY)
+            except Exception as e:
+                # The ticket is already uploaded; only the cache entry is lost
+                logger.warning("Render cache store failed: %s", e)
+                render_result_cache.record_error()
+        return response
 
     except KeyError as e:
-        logger.error(f"Missing required field in payload: {e}")  # <-- ERROR LOG
+        logger.error("Missing required field in payload: %s", e)  # <-- ERROR LOG
+        metrics.set_property("Error", "KeyError")
         return {
             "statusCode": 400,
             "body": json.dumps({"error": f"Missing required field in payload: {e}"}),
         }
     except Exception as e:
         logger.error(
-            f"An unexpected error occurred: {e}", exc_info=True
+            "An unexpected error occurred: %s", e, exc_info=True
         )  # <-- DETAILED ERROR LOG
+        metrics.set_property("Error", type(e).__name__)
         return {"statusCode": 500, "body": json.dumps({"error": str(e)})}
+    finally:
+        if METRICS_ENABLED:
+            metrics.emit()
+
+
+@request_logging.handler
+@invocation_profiler.handler(flag_for=None)
+def sqs_handler(event, context):
+    """
+    Entry point for an SQS event source mapping (configure it with
+    ReportBatchItemFailures). Each message body is the same JSON payload the API
+    accepts for a single ticket. All messages in the batch share the template
+    cache and render context (and the render pool, when running), and only the
+    messages that failed are returned in 'batchItemFailures' to be retried.
+    """
+    records = event.get("Records", [])
+    logger.info("--- STARTING SQS BATCH: %s messages ---", len(records))
+
+    if not S3_BUCKET_NAME:
+        # Nothing in this batch can succeed; raising returns it all to the queue
+        raise RuntimeError("Lambda environment variable S3_BUCKET_NAME is not set.")
+    BUCKET = S3_BUCKET_NAME
+
+    results = [{"index": index} for index in range(len(records))]
+    jobs = []
+    for index, record in enumerate(records):
+        try:
+            payload = json.loads(record["body"])
+            variable_substitutions = payload.get("variableSubstitutions", {})
+            if not isinstance(variable_substitutions, dict):
+                raise ValueError("SQS messages carry exactly one ticket each.")
+            output_key = f"{payload['eventName']}/{payload['user']}/{payload['pdf_filename']}"
+
+            template_entry, cache_outcome = template_cache.get(
+                s3_client, BUCKET, payload["template_s3_key"]
+            )
+            logger.info(
+                "Message %s: template cache %s, output key %s",
+                record['messageId'],
+                cache_outcome,
+                output_key,
+            )
+            variable_substitutions = prepare_substitutions(
+                variable_substitutions,
+                payload.get("background_color", "white"),
+                payload.get("font_color", "black"),
+            )
+            html_content, _, _ = substitute_ticket_html(
+                template_entry,
+                variable_substitutions,
+                document_date_for(template_entry, payload.get("document_date")),
+            )
+            jobs.append((index, output_key, html_content))
+        except KeyError as e:
+            logger.error("Message %s: missing required field %s", record.get('messageId'), e)
+            results[index].update(status="failed", error=f"Missing required field: {e}")
+        except Exception as e:
+            logger.error("Message %s failed: %s", record.get('messageId'), e, exc_info=True)
+            results[index].update(status="failed", error=str(e))
+
+    upload_rendered_jobs(BUCKET, jobs, results, f"s3://{BUCKET}/")
+
+    failures = [
+        {"itemIdentifier": records[result["index"]]["messageId"]}
+        for result in results
+        if result.get("status") != "succeeded"
+    ]
+    logger.info(
+        "SQS batch complete: %s succeeded, %s failed.", len(records) - len(failures), len(failures)
+    )
+    return {"batchItemFailures": failures}
+
+
+def render_manifest(bucket, manifest_key):
+    """
+    Renders every guest in a CSV/JSONL manifest to '{eventName}/{user}/{pdf_filename}'.
+
+    The manifest is streamed and rendered in chunks of MANIFEST_CHUNK_SIZE rows, and
+    one result line per row is streamed to
+    '{MANIFEST_RESULTS_PREFIX}{manifest_key}.results.jsonl'. Job settings come from the
+    manifest object's user metadata (see manifest.manifest_settings).
+
+    The results file is a multipart upload that only exists once complete, so
+    '{MANIFEST_RESULTS_PREFIX}{manifest_key}.progress.json' is rewritten after every
+    chunk with the counts so far and the first failed rows, and finally with
+    status 'completed' or 'failed'. A progress object left at 'running' whose
+    updated_at stopped advancing belongs to an invocation that timed out.
+
+    Returns a summary dict.
+    """
+    s3_response = s3_client.get_object(Bucket=bucket, Key=manifest_key)
+    settings = manifest_settings(s3_response.get("Metadata", {}), manifest_key)
+    event_name = settings["event_name"]
+    template_key = settings["template_s3_key"]
+    background_color = settings["background_color"]
+    font_color = settings["font_color"]
+    column_map = settings["column_map"]
+    defaults = {"document_date": settings["document_date"]}
+    results_key = f"{MANIFEST_RESULTS_PREFIX}{manifest_key}.results.jsonl"
+    progress_key = f"{MANIFEST_RESULTS_PREFIX}{manifest_key}.progress.json"
+    logger.info(
+        "Rendering manifest s3://%s/%s: EventName=%s, TemplateKey=%s, results to %s",
+        bucket,
+        manifest_key,
+        event_name,
+        template_key,
+        results_key,
+    )
+
+    # Fetch and compile the template once for the whole manifest
+    template_entry, cache_outcome = template_cache.get(s3_client, bucket, template_key)
+    get_compiled_template(template_entry)
+    logger.info("Template cache %s (ETag=%s)", cache_outcome, template_entry.etag)
+
+    base_url = f"s3://{bucket}/"
+    rows = iter_manifest_rows(s3_response["Body"], manifest_key)
+    summary = {
+        "manifest": f"s3://{bucket}/{manifest_key}",
+        "results": f"s3://{bucket}/{results_key}",
+        "progress": f"s3://{bucket}/{progress_key}",
+        "rows": 0,
+        "succeeded": 0,
+        "failed": 0,
+    }
+    failures = []
+    seen_keys = set()
+    write_manifest_progress(bucket, progress_key, summary, "running", failures)
+    try:
+        with S3MultipartWriter(
+            s3_client, bucket, results_key, content_type="application/x-ndjson"
+        ) as results_writer:
+            while True:
+                chunk = [map_row(row, column_map) for row in itertools.islice(rows, MANIFEST_CHUNK_SIZE)]
+                if not chunk:
+                    break
+                results, jobs = prepare_batch(
+                    bucket,
+                    template_entry,
+                    event_name,
+                    chunk,
+                    defaults,
+                    background_color,
+                    font_color,
+                    seen_keys=seen_keys,
+                )
+                upload_rendered_jobs(bucket, jobs, results, base_url)
+                for result in results:
+                    # 1-based data row number, as a spreadsheet user would count guests
+                    result["row"] = summary["rows"] + result.pop("index") + 1
+                    summary[result["status"]] += 1
+                    if result["status"] == "failed" and len(failures) < MANIFEST_PROGRESS_MAX_FAILURES:
+                        failures.append({"row": result["row"], "error": result.get("error")})
+                    results_writer.write((json.dumps(result) + "\n").encode("utf-8"))
+                summary["rows"] += len(chunk)
+                logger.info(
+                    "Manifest progress: %s rows, %s succeeded, %s failed.",
+                    summary["rows"],
+                    summary["succeeded"],
+                    summary["failed"],
+                )
+                write_manifest_progress(bucket, progress_key, summary, "running", failures)
+    except Exception as e:
+        write_manifest_progress(bucket, progress_key, summary, "failed", failures, error=str(e))
+        raise
+    write_manifest_progress(bucket, progress_key, summary, "completed", failures)
+    return summary
+
+
+def write_manifest_progress(bucket, progress_key, summary, status, failures, error=None):
+    progress = dict(summary, status=status, failures=failures, updated_at=w3c_date(datetime.now(timezone.utc)))
+    if error is not None:
+        progress["error"] = error
+    try:
+        s3_client.put_object(
+            Bucket=bucket,
+            Key=progress_key,
+            Body=json.dumps(progress).encode("utf-8"),
+            ContentType="application/json",
+        )
+    except Exception as e:
+        # Progress is informational; the results file remains the record
+        logger.warning("Could not write manifest progress %s: %s", progress_key, e)
+
+
+@request_logging.handler
+@invocation_profiler.handler(flag_for=None)
+def manifest_handler(event, context):
+    """
+    Entry point for S3 ObjectCreated notifications on guest manifests (.csv or
+    .jsonl). Every manifest in the event is rendered with render_manifest().
+    """
+    summaries = []
+    for record in event.get("Records", []):
+        bucket = record["s3"]["bucket"]["name"]
+        manifest_key = unquote_plus(record["s3"]["object"]["key"])
+        if manifest_key.startswith(MANIFEST_RESULTS_PREFIX):
+            logger.info("Ignoring results manifest %s", manifest_key)
+            continue
+        summary = render_manifest(bucket, manifest_key)
+        logger.info("Manifest complete: %s", json.dumps(summary))
+        summaries.append(summary)
+    return {"manifests": summaries}
+
+
+def make_chunk_invoker(store):
+    """Raises ValueError when COORDINATOR_INVOKER or its target is not configured."""
+    if COORDINATOR_INVOKER == "inprocess":
+        return InProcessInvoker(chunk_worker_handler)
+    if COORDINATOR_INVOKER == "stepfunctions":
+        return StepFunctionsInvoker(
+            boto3.client("stepfunctions"), CHUNK_STATE_MACHINE_ARN, store
+        )
+    if COORDINATOR_INVOKER == "lambda":
+        return LambdaInvoker(boto3.client("lambda"), CHUNK_WORKER_FUNCTION_NAME)
+    raise ValueError(f"Unknown COORDINATOR_INVOKER: {COORDINATOR_INVOKER}")
+
+
+@request_logging.handler
+@invocation_profiler.handler(flag_for=None)
+def coordinator_handler(event, context):
+    """
+    Entry point for jobs too big for a single invocation (e.g. a 20k-guest event).
+
+    The event is either a status query, {"action": "status", "job_id": ...}, or a
+    job: the batch payload fields (eventName, template_s3_key, colors and a list
+    of variableSubstitutions) or {"manifest_key": ...} for a guest manifest in S3.
+    The job is split into size-tuned chunks (or "chunk_size" if given), one worker
+    invocation is dispatched per chunk, and the job record is returned; its
+    job_id can be polled with the status action.
+    """
+    bucket = event.get("bucket") or S3_BUCKET_NAME
+    if not bucket:
+        raise RuntimeError("Lambda environment variable S3_BUCKET_NAME is not set.")
+    store = JobStore(s3_client, bucket, JOBS_PREFIX)
+
+    if event.get("action") == "status":
+        return store.job_status(event["job_id"])
+
+    # Checked before anything is read or written, so a misconfigured function
+    # fails fast instead of leaving an orphaned job in S3
+    invoker = make_chunk_invoker(store)
+
+    if "manifest_key" in event:
+        manifest_key = event["manifest_key"]
+        s3_response = s3_client.get_object(Bucket=bucket, Key=manifest_key)
+        job_settings = manifest_settings(s3_response.get("Metadata", {}), manifest_key)
+        column_map = job_settings.pop("column_map")
+        items = (
+            map_row(row, column_map)
+            for row in iter_manifest_rows(s3_response["Body"], manifest_key)
+        )
+        total_items = None
+        job_settings["defaults"] = {"document_date": job_settings.pop("document_date")}
+    else:
+        items = event["variableSubstitutions"]
+        total_items = len(items)
+        job_settings = {
+            "event_name": event["eventName"],
+            "template_s3_key": event["template_s3_key"],
+            "background_color": event.get("background_color", "white"),
+            "font_color": event.get("font_color", "black"),
+            "defaults": {
+                "user": event.get("user"),
+                "pdf_filename": event.get("pdf_filename"),
+                "document_date": event.get("document_date"),
+            },
+        }
+
+    chunk_size = event.get("chunk_size") or chunk_size_for(
+        COORDINATOR_SECONDS_PER_TICKET,
+        COORDINATOR_TARGET_CHUNK_SECONDS,
+        COORDINATOR_MAX_CHUNK_SIZE,
+        total_items,
+    )
+    job = start_job(store, invoker, job_settings, items, chunk_size)
+    logger.info(
+        "Dispatched job %s: %s tickets in %s chunks of up to %s via %s.",
+        job['job_id'],
+        job['total_items'],
+        job['chunk_count'],
+        chunk_size,
+        COORDINATOR_INVOKER,
+    )
+    return job
+
+
+@request_logging.handler
+@invocation_profiler.handler(flag_for=None)
+def chunk_worker_handler(event, context):
+    """
+    Renders one chunk of a coordinator job. The event is the work item
+    {"bucket", "job_id", "chunk_index", "chunk_key"} (also the Distributed Map
+    item shape). Writes and returns the chunk status; if the chunk cannot be
+    rendered at all, the status carries an "error" and counts all its items as
+    failed.
+    """
+    bucket = event["bucket"]
+    store = JobStore(s3_client, bucket, JOBS_PREFIX)
+    chunk = None
+    try:
+        job = store.get_json(store.job_key(event["job_id"]))
+        chunk = store.get_json(event["chunk_key"])
+        logger.info(
+            "Rendering chunk %s of job %s: %s tickets",
+            event['chunk_index'],
+            event['job_id'],
+            len(chunk['items']),
+        )
+
+        template_entry, cache_outcome = template_cache.get(
+            s3_client, bucket, job["template_s3_key"]
+        )
+        results, jobs = prepare_batch(
+            bucket,
+            template_entry,
+            job["event_name"],
+            chunk["items"],
+            job["defaults"],
+            job["background_color"],
+            job["font_color"],
+        )
+        upload_rendered_jobs(bucket, jobs, results, f"s3://{bucket}/")
+
+        failures = [
+            {"item": chunk["start"] + result["index"], "error": result["error"]}
+            for result in results
+            if result["status"] == "failed"
+        ]
+        status = {
+            "chunk_index": event["chunk_index"],
+            "succeeded": len(results) - len(failures),
+            "failed": len(failures),
+            "failures": failures,
+        }
+    except Exception as e:
+        # Still write a status, or the job would never be reported complete
+        logger.error(
+            "Chunk %s of job %s failed: %s",
+            event['chunk_index'],
+            event['job_id'],
+            e,
+            exc_info=True,
+        )
+        status = {
+            "chunk_index": event["chunk_index"],
+            "succeeded": 0,
+            "failed": len(chunk["items"]) if chunk is not None else 0,
+            "failures": [],
+            "error": str(e),
+        }
+    store.put_json(store.status_key(event["job_id"], event["chunk_index"]), status)
+    return status
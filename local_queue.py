@@ -0,0 +1,93 @@
+"""
+In-memory stand-in for an SQS queue plus its Lambda event source mapping, for
+exercising sqs_handler locally:
+
+    queue = InMemoryQueue(batch_size=10)
+    queue.send_message(json.dumps(payload))
+    queue.drain(lambda_function.sqs_handler)
+
+It follows the ReportBatchItemFailures contract: messages listed in
+'batchItemFailures' go back on the queue, the rest are deleted, and a handler
+exception returns the whole batch. Messages received more than
+'max_receive_count' times are moved to 'dead_letters'.
+"""
+import itertools
+import json
+from collections import deque
+
+
+class InMemoryQueue:
+    def __init__(
+        self,
+        batch_size=10,
+        max_receive_count=3,
+        arn="arn:aws:sqs:local:000000000000:ticket-requests",
+    ):
+        self.batch_size = batch_size
+        self.max_receive_count = max_receive_count
+        self.arn = arn
+        self.dead_letters = []
+        self._messages = deque()
+        self._ids = itertools.count(1)
+
+    def __len__(self):
+        return len(self._messages)
+
+    def send_message(self, body):
+        if not isinstance(body, str):
+            body = json.dumps(body)
+        message = {"messageId": f"local-{next(self._ids)}", "body": body, "receive_count": 0}
+        self._messages.append(message)
+        return message["messageId"]
+
+    def receive_event(self):
+        """Takes up to batch_size messages off the queue as an SQS Lambda event."""
+        batch = []
+        while self._messages and len(batch) < self.batch_size:
+            message = self._messages.popleft()
+            message["receive_count"] += 1
+            batch.append(message)
+        return batch, {"Records": [self._record(message) for message in batch]}
+
+    def apply_response(self, batch, response):
+        """Deletes succeeded messages and requeues (or dead-letters) failed ones."""
+        failed_ids = {
+            failure["itemIdentifier"]
+            for failure in (response or {}).get("batchItemFailures", [])
+        }
+        for message in batch:
+            if message["messageId"] in failed_ids:
+                self._requeue(message)
+
+    def drain(self, handler, context=None):
+        """Invokes 'handler' until the queue is empty. Returns the number of invocations."""
+        invocations = 0
+        while self._messages:
+            batch, event = self.receive_event()
+            invocations += 1
+            try:
+                response = handler(event, context)
+            except Exception:
+                for message in batch:
+                    self._requeue(message)
+                continue
+            self.apply_response(batch, response)
+        return invocations
+
+    def _requeue(self, message):
+        if message["receive_count"] >= self.max_receive_count:
+            self.dead_letters.append(message)
+        else:
+            self._messages.append(message)
+
+    def _record(self, message):
+        return {
+            "messageId": message["messageId"],
+            "receiptHandle": f"{message['messageId']}-{message['receive_count']}",
+            "body": message["body"],
+            "attributes": {"ApproximateReceiveCount": str(message["receive_count"])},
+            "messageAttributes": {},
+            "eventSource": "aws:sqs",
+            "eventSourceARN": self.arn,
+            "awsRegion": self.arn.split(":")[3],
+        }
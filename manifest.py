@@ -0,0 +1,69 @@
+import codecs
+import csv
+import json
+import os
+
+TRUE_STRINGS = ("1", "true", "yes", "y", "b", "x")
+
+
+def manifest_format(key):
+    lowered = key.lower()
+    if lowered.endswith(".csv"):
+        return "csv"
+    if lowered.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    raise ValueError(f"Unsupported manifest type (expected .csv or .jsonl): {key}")
+
+
+def manifest_settings(metadata, key):
+    """
+    Reads the job settings stored as user metadata on a manifest object:
+
+        template-s3-key   (required)
+        event-name        (defaults to the manifest file name without extension)
+        background-color, font-color
+        column-map        JSON object renaming manifest columns to template variables
+        document-date     ISO 8601 date written into every ticket's PDF metadata
+    """
+    return {
+        "event_name": metadata.get("event-name") or os.path.splitext(os.path.basename(key))[0],
+        "template_s3_key": metadata["template-s3-key"],
+        "background_color": metadata.get("background-color", "white"),
+        "font_color": metadata.get("font-color", "black"),
+        "column_map": json.loads(metadata.get("column-map", "{}")),
+        "document_date": metadata.get("document-date"),
+    }
+
+
+def iter_manifest_rows(body, key):
+    """
+    Yields one dict per guest from a manifest stream (an S3 StreamingBody or any
+    binary file object), decoding it incrementally so the manifest is never
+    loaded into memory as a whole. CSV manifests need a header row.
+    """
+    reader = codecs.getreader("utf-8-sig")(body)
+    if manifest_format(key) == "csv":
+        for row in csv.DictReader(reader):
+            yield _from_csv(row)
+    else:
+        for line in reader:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def map_row(row, column_map):
+    """
+    Turns a manifest row into a batch item: 'column_map' renames columns to
+    template variables ({"Guest Name": "guestFirstNameLastName"}); any other
+    column is used under its own name.
+    """
+    return {column_map.get(column, column): value for column, value in row.items()}
+
+
+def _from_csv(row):
+    # CSV cells are always strings; 'breakfast' is the one boolean we rely on
+    row = {column.strip(): value for column, value in row.items() if column}
+    if isinstance(row.get("breakfast"), str):
+        row["breakfast"] = row["breakfast"].strip().lower() in TRUE_STRINGS
+    return row
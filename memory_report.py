@@ -0,0 +1,157 @@
+"""
+Memory-size recommendation per template from the lambda_handler EMF lines:
+
+    aws logs filter-log-events --log-group-name /aws/lambda/<function> \\
+        --filter-pattern '{ $.MaxMemoryUsed > 0 }' --query 'events[].message' \\
+        --output json | python memory_report.py
+    python memory_report.py exported-logs.jsonl [--headroom 0.2] [--step 64]
+
+Reads logs (from files or stdin) and keeps the EMF documents that carry
+MaxMemoryUsed. Input is either a JSON array of messages, as printed by
+--output json, or log lines; tab-separated messages on one line (--output
+text) are split apart. For every TemplateKey it prints the peak memory
+distribution, the phase that most often held the peak and a memory size: the
+largest peak seen (running out of memory kills the invocation, so not a
+percentile) plus 'headroom', rounded up to 'step' MB (Lambda allows 128 to
+10240 MB). It then breaks the peaks down by batch size (the Tickets metric)
+and by the longest substitution value (LongestValueChars, e.g. a guest name),
+with the fitted MB per extra ticket / per 100 characters.
+
+Lambda CPU grows with memory (one full vCPU at 1769 MB), so a size picked for
+memory alone may still be worth raising for render latency.
+"""
+import argparse
+import fileinput
+import json
+import math
+from collections import Counter, defaultdict
+
+MIN_MEMORY_MB = 128
+MAX_MEMORY_MB = 10240
+
+TICKET_BUCKETS = (1, 10, 50, 200, 1000)
+VALUE_CHAR_BUCKETS = (32, 64, 128, 256, 1024)
+
+
+def read_documents(text):
+    try:
+        messages = json.loads(text)
+    except ValueError:
+        messages = None
+    if not isinstance(messages, list):
+        messages = [message for line in text.splitlines() for message in line.split("\t")]
+    for message in messages:
+        document = message if isinstance(message, dict) else _parse_message(message)
+        if isinstance(document, dict) and "_aws" in document and "MaxMemoryUsed" in document:
+            yield document
+
+
+def _parse_message(message):
+    # Exported lines may carry a timestamp / request id before the JSON
+    start = message.find("{") if isinstance(message, str) else -1
+    if start < 0:
+        return None
+    try:
+        return json.loads(message[start:])
+    except ValueError:
+        return None
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def recommended_memory(peaks, headroom, step):
+    needed = max(peaks) * (1 + headroom)
+    return min(MAX_MEMORY_MB, max(MIN_MEMORY_MB, math.ceil(needed / step) * step))
+
+
+def peak_phase(document):
+    phases = {
+        name[:-len("PeakMemory")]: value
+        for name, value in document.items()
+        if name.endswith("PeakMemory") and isinstance(value, (int, float))
+    }
+    return max(phases, key=phases.get) if phases else None
+
+
+def bucket_label(value, bounds):
+    lower = 0
+    for bound in bounds:
+        if value <= bound:
+            return f"{lower + 1 if lower else 0}-{bound}"
+        lower = bound
+    return f">{bounds[-1]}"
+
+
+def slope(points):
+    """Least-squares slope of y over x, or None if x never varies."""
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    if not variance:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / variance
+
+
+def breakdown(documents, metric, bounds):
+    buckets = defaultdict(list)
+    for document in documents:
+        buckets[bucket_label(document.get(metric) or 0, bounds)].append(document["MaxMemoryUsed"])
+    order = [bucket_label(bound, bounds) for bound in bounds] + [f">{bounds[-1]}"]
+    return [(label, buckets[label]) for label in order if buckets[label]]
+
+
+def report(documents, headroom=0.2, step=64):
+    by_template = defaultdict(list)
+    for document in documents:
+        by_template[document.get("TemplateKey") or "(none)"].append(document)
+    lines = []
+    for template_key, template_documents in sorted(by_template.items()):
+        peaks = [document["MaxMemoryUsed"] for document in template_documents]
+        limits = {document.get("MemoryLimitMB") for document in template_documents} - {None}
+        phases = Counter(peak_phase(document) for document in template_documents)
+        lines.append(f"{template_key}  ({len(peaks)} invocations, configured {'/'.join(map(str, sorted(limits))) or '?'} MB)")
+        lines.append(
+            f"  peak MB: p50 {percentile(peaks, 0.5):.0f}  p95 {percentile(peaks, 0.95):.0f}"
+            f"  p99 {percentile(peaks, 0.99):.0f}  max {max(peaks):.0f}"
+        )
+        lines.append(
+            "  peak phase: " + ", ".join(f"{phase} {count}x" for phase, count in phases.most_common(3) if phase)
+        )
+        lines.append(f"  recommended memory size: {recommended_memory(peaks, headroom, step)} MB")
+        for title, metric, bounds, unit, scale in (
+            ("tickets per invocation", "Tickets", TICKET_BUCKETS, "MB per ticket", 1),
+            ("longest value (chars)", "LongestValueChars", VALUE_CHAR_BUCKETS, "MB per 100 chars", 100),
+        ):
+            if not any(document.get(metric) for document in template_documents):
+                continue
+            rows = breakdown(template_documents, metric, bounds)
+            lines.append(f"  by {title}:")
+            for label, bucket_peaks in rows:
+                lines.append(f"    {label:>10}: {len(bucket_peaks):>6} invocations, max {max(bucket_peaks):.0f} MB")
+            fitted = slope([(document.get(metric) or 0, document["MaxMemoryUsed"]) for document in template_documents])
+            if fitted is not None:
+                lines.append(f"    fitted: {fitted * scale:+.2f} {unit}")
+        lines.append("")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("files", nargs="*", help="log files (default: stdin)")
+    parser.add_argument("--headroom", type=float, default=0.2, help="fraction added to the peak (default 0.2)")
+    parser.add_argument("--step", type=int, default=64, help="round sizes up to this many MB (default 64)")
+    args = parser.parse_args()
+    with fileinput.input(args.files) as lines:
+        documents = list(read_documents("".join(lines)))
+    if not documents:
+        raise SystemExit("No EMF lines with MaxMemoryUsed found.")
+    print(report(documents, args.headroom, args.step))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Memory high-water marks for the per-invocation metrics.
+
+The peak RSS of the process (VmHWM in /proc/self/status) is reset at the start
+of every phase by writing '5' to /proc/self/clear_refs, so each phase reports
+its own peak instead of the largest one since the container started. Where
+/proc is unavailable or clear_refs is not writable, the fallback is
+resource.getrusage's ru_maxrss, which never goes down: a phase then reports
+the peak reached up to its end.
+
+Render pool workers run inside the same Lambda memory limit, but are forked
+from the handler and share its unmodified pages copy-on-write, so adding their
+RSS would count those pages once per worker. With workers running, every
+process (the handler included) is instead counted by its proportional set
+size (Pss in /proc/<pid>/smaps_rollup, shared pages split between the
+processes mapping them) plus how far its RSS has fallen from its peak
+(VmHWM - VmRSS), i.e. the private memory it allocated and freed again during
+the phase.
+
+Optionally (trace_top > 0) tracemalloc also tracks Python allocations, giving
+a traced peak per phase and the top allocating source lines.
+"""
+import resource
+import sys
+import tracemalloc
+
+MEGABYTE = 1024 * 1024
+
+
+def _status_kilobytes(pid, field, name="status"):
+    try:
+        with open(f"/proc/{pid}/{name}") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _reset_peak(pid):
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _proportional_kilobytes(pid):
+    pss = _status_kilobytes(pid, "Pss", "smaps_rollup")
+    if pss is None:
+        return None
+    hwm = _status_kilobytes(pid, "VmHWM") or 0
+    rss = _status_kilobytes(pid, "VmRSS") or 0
+    return pss + max(0, hwm - rss)
+
+
+def _max_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+class MemoryWatermark:
+    """
+    Peak memory between reset() and peak(). 'worker_pids' is a callable
+    returning the pids of worker processes to include (e.g. RenderPool.pids).
+    """
+
+    def __init__(self, worker_pids=None, trace_top=0):
+        self.worker_pids = worker_pids
+        self.trace_top = trace_top
+        self.resettable = _reset_peak("self")
+        if trace_top and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def reset(self):
+        if self.resettable:
+            _reset_peak("self")
+            for pid in self._worker_pids():
+                _reset_peak(pid)
+        if self.trace_top:
+            tracemalloc.reset_peak()
+
+    def peak(self):
+        """(peak RSS in bytes, peak traced bytes or None) since the last reset."""
+        worker_pids = list(self._worker_pids())
+        proportional = _proportional_kilobytes("self") if worker_pids else None
+        if proportional is not None:
+            # The handler's share of the pages it shares with the workers
+            rss = sum((_proportional_kilobytes(pid) or 0 for pid in worker_pids), proportional) * 1024
+        else:
+            rss = _status_kilobytes("self", "VmHWM")
+            rss = rss * 1024 if rss is not None else _max_rss_bytes()
+        traced = tracemalloc.get_traced_memory()[1] if self.trace_top else None
+        return rss, traced
+
+    def traced(self):
+        """Bytes currently held by traced Python allocations (0 when not tracing)."""
+        return tracemalloc.get_traced_memory()[0] if self.trace_top else 0
+
+    def top_allocators(self):
+        """The 'trace_top' source lines holding the most traced memory right now."""
+        if not self.trace_top:
+            return []
+        statistics = tracemalloc.take_snapshot().statistics("lineno")
+        return [
+            {
+                "location": f"{statistic.traceback[0].filename}:{statistic.traceback[0].lineno}",
+                "kilobytes": round(statistic.size / 1024, 1),
+                "blocks": statistic.count,
+            }
+            for statistic in statistics[:self.trace_top]
+        ]
+
+    def _worker_pids(self):
+        return self.worker_pids() if self.worker_pids is not None else ()
@@ -0,0 +1,134 @@
+"""
+Per-invocation latency metrics, written as one CloudWatch Embedded Metric
+Format (EMF) line per invocation. CloudWatch extracts the metrics from the log
+line itself, so they cost no API calls; properties (template key, cache
+outcomes, ...) ride along for Logs Insights queries. memory_report.py turns
+the memory metrics into a memory-size recommendation per template.
+"""
+import json
+import sys
+import time
+
+from memory_usage import MEGABYTE
+
+_cold_start = True
+
+
+def take_cold_start():
+    """True for the first invocation in this process, False afterwards."""
+    global _cold_start
+    cold_start, _cold_start = _cold_start, False
+    return cold_start
+
+
+class InvocationMetrics:
+    """
+    Phase timings and metrics of one invocation.
+
+    Phases run back to back: start_phase(name) ends the current phase and starts
+    timing the next, so the handler marks where each stage begins without
+    re-nesting its code, an early return simply ends the last phase, and the
+    phases add up to the total. Phases entered more than once accumulate.
+    add_phase() records a duration measured elsewhere, such as the sub-phases
+    of a phase, which are reported alongside it and not counted twice.
+
+    With a MemoryWatermark ('memory'), each phase also reports its peak RSS
+    (<Phase>PeakMemory) and, if tracemalloc is on, its traced peak
+    (<Phase>TracedPeak); MaxMemoryUsed is the invocation's peak. The top
+    allocators are captured at the end of the phase holding the most traced
+    memory and attached as the TopAllocators property.
+    """
+
+    def __init__(self, namespace, handler, cold_start=False, memory=None):
+        self.namespace = namespace
+        self.dimensions = {"Handler": handler}
+        self.properties = {"ColdStart": cold_start}
+        self.phases = {}
+        self._metrics = {}
+        self._started = time.perf_counter()
+        self._phase = None
+        self._phase_started = None
+        self.memory = memory
+        self.memory_peaks = {}
+        self._max_memory = 0
+        self._top_traced = 0
+        if memory is not None:
+            memory.reset()
+
+    def start_phase(self, phase):
+        now = time.perf_counter()
+        self._end_phase(now)
+        if self.memory is not None:
+            self.memory.reset()
+        self._phase = phase
+        self._phase_started = now
+
+    def end_phase(self):
+        self._end_phase(time.perf_counter())
+        self._phase = None
+
+    def add_phase(self, phase, milliseconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + milliseconds
+
+    def put_metric(self, name, value, unit="None"):
+        self._metrics[name] = (value, unit)
+
+    def set_property(self, name, value):
+        self.properties[name] = value
+
+    def record(self):
+        """The EMF document for this invocation (ends the current phase)."""
+        self.end_phase()
+        metrics = dict(self._metrics)
+        for phase, milliseconds in self.phases.items():
+            metrics[f"{phase}Time"] = (round(milliseconds, 3), "Milliseconds")
+        for phase, (rss, traced) in self.memory_peaks.items():
+            metrics[f"{phase}PeakMemory"] = (round(rss / MEGABYTE, 1), "Megabytes")
+            if traced is not None:
+                metrics[f"{phase}TracedPeak"] = (round(traced / MEGABYTE, 1), "Megabytes")
+        if self.memory is not None:
+            metrics["MaxMemoryUsed"] = (round(self._max_memory / MEGABYTE, 1), "Megabytes")
+        metrics["TotalTime"] = (round((time.perf_counter() - self._started) * 1000, 3), "Milliseconds")
+        document = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": self.namespace,
+                        "Dimensions": [list(self.dimensions)],
+                        "Metrics": [{"Name": name, "Unit": unit} for name, (_, unit) in metrics.items()],
+                    }
+                ],
+            },
+        }
+        document.update(self.properties)
+        document.update(self.dimensions)
+        document.update((name, value) for name, (value, _) in metrics.items())
+        return document
+
+    def emit(self, stream=None):
+        # Printed, not logged: EMF must be the whole log line, not a field of one
+        stream = stream or sys.stdout
+        stream.write(json.dumps(self.record(), default=str) + "\n")
+        stream.flush()
+
+    def _end_phase(self, now):
+        if self.memory is not None:
+            self._end_phase_memory()
+        if self._phase is not None:
+            self.add_phase(self._phase, (now - self._phase_started) * 1000)
+
+    def _end_phase_memory(self):
+        rss, traced = self.memory.peak()
+        self._max_memory = max(self._max_memory, rss)
+        if self._phase is None:
+            return
+        # Phases entered more than once keep their largest peak
+        previous_rss, previous_traced = self.memory_peaks.get(self._phase, (0, None))
+        if traced is not None and previous_traced is not None:
+            traced = max(traced, previous_traced)
+        self.memory_peaks[self._phase] = (max(rss, previous_rss), traced)
+        held = self.memory.traced()
+        if held > self._top_traced:
+            self._top_traced = held
+            self.set_property("TopAllocators", {"phase": self._phase, "allocators": self.memory.top_allocators()})
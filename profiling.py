@@ -0,0 +1,238 @@
+"""
+On-demand profiling of single invocations.
+
+Profiling is switched on either for every invocation, with the PROFILER
+environment variable, or for one request, with a "profile" flag signed with
+PROFILE_SIGNING_KEY (see sign_profile_flag), so it can be used against a
+production function without redeploying it and without letting arbitrary
+callers slow it down. A profiled invocation writes, under the configured
+output ('s3://bucket/prefix/' or a local directory such as /tmp/profiles):
+
+- '{name}.pstats' (cprofile), loadable with pstats / snakeviz, or
+  '{name}.html' (pyinstrument, if installed);
+- '{name}.collapsed', stacks sampled every few milliseconds in the collapsed
+  format of flamegraph.pl / speedscope / inferno ("a;b;c <count>" per line).
+
+With the switch off, the only cost is a dict lookup and a substring check on
+the request body; no profiler is imported or started.
+
+To sign a flag for the next 10 minutes:
+
+    PROFILE_SIGNING_KEY=... python profiling.py cprofile 600
+"""
+import functools
+import hashlib
+import hmac
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from s3_fetcher import split_s3_url
+
+logger = logging.getLogger(__name__)
+
+PROFILERS = ("cprofile", "pyinstrument")
+
+
+def profile_flag_signature(signing_key, profiler, expires):
+    message = f"{profiler}:{int(expires)}".encode("utf-8")
+    return hmac.new(signing_key.encode("utf-8"), message, hashlib.sha256).hexdigest()
+
+
+def sign_profile_flag(signing_key, profiler="cprofile", expires_in=600):
+    """The "profile" value for a request body, valid for 'expires_in' seconds."""
+    expires = int(time.time()) + expires_in
+    return {
+        "profiler": profiler,
+        "expires": expires,
+        "signature": profile_flag_signature(signing_key, profiler, expires),
+    }
+
+
+def verify_profile_flag(signing_key, flag):
+    """
+    The profiler a signed "profile" flag asks for, or None if the flag is
+    malformed, expired, names an unknown profiler or carries a bad signature.
+    """
+    if not signing_key or not isinstance(flag, dict):
+        return None
+    profiler = flag.get("profiler", "cprofile")
+    try:
+        expires = int(flag["expires"])
+        signature = str(flag["signature"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if profiler not in PROFILERS or expires < time.time():
+        return None
+    if not hmac.compare_digest(signature, profile_flag_signature(signing_key, profiler, expires)):
+        return None
+    return profiler
+
+
+def body_profile_flag(event):
+    """The "profile" flag of an API Gateway request body, parsed only if present."""
+    body = event.get("body") if isinstance(event, dict) else None
+    if not body or '"profile"' not in body:
+        return None
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return None
+    return payload.get("profile") if isinstance(payload, dict) else None
+
+
+class StackSampler:
+    """
+    Samples the stack of one thread every 'interval' seconds from a background
+    thread and counts each distinct stack, root first.
+    """
+
+    def __init__(self, thread_id=None, interval=0.005):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if frames:
+                self.stacks[";".join(reversed(frames))] += 1
+
+
+class InvocationProfiler:
+    """
+    Runs selected Lambda invocations under a profiler and writes the results to
+    'output'. 'profiler' profiles every invocation; 'signing_key' enables signed
+    per-request flags. Writing a profile never fails the invocation.
+    """
+
+    def __init__(self, profiler=None, signing_key=None, output="/tmp/profiles", s3_client=None, sample_interval=0.005):
+        if profiler and profiler not in PROFILERS:
+            raise ValueError(f"Unknown profiler {profiler!r}; expected one of {PROFILERS}")
+        self.profiler = profiler or None
+        self.signing_key = signing_key or None
+        self.output = output
+        self.s3_client = s3_client
+        self.sample_interval = sample_interval
+
+    def selected(self, event, flag_for=body_profile_flag):
+        """The profiler to run for 'event', or None (the common, cheap case)."""
+        if self.profiler:
+            return self.profiler
+        if self.signing_key is None or flag_for is None:
+            return None
+        flag = flag_for(event)
+        if flag is None:
+            return None
+        profiler = verify_profile_flag(self.signing_key, flag)
+        if profiler is None:
+            logger.warning("Ignoring invalid or expired profile flag")
+        return profiler
+
+    def handler(self, function=None, flag_for=body_profile_flag):
+        """
+        Decorates a Lambda entry point. 'flag_for(event)' extracts the signed
+        flag from an event; with flag_for=None only PROFILER switches it on.
+        """
+        if function is None:
+            return functools.partial(self.handler, flag_for=flag_for)
+
+        @functools.wraps(function)
+        def wrapper(event, context):
+            profiler = self.selected(event, flag_for)
+            if profiler is None:
+                return function(event, context)
+            name = f"{function.__name__}-{getattr(context, 'aws_request_id', None) or int(time.time() * 1000)}"
+            return self.run(profiler, name, function, event, context)
+
+        return wrapper
+
+    def run(self, profiler, name, function, *args):
+        if profiler == "pyinstrument":
+            try:
+                import pyinstrument
+            except ImportError:
+                logger.warning("pyinstrument is not installed; profiling with cprofile instead")
+                profiler = "cprofile"
+        sampler = StackSampler(interval=self.sample_interval)
+        if profiler == "pyinstrument":
+            session = pyinstrument.Profiler(interval=self.sample_interval / 5)
+            start, stop = session.start, session.stop
+        else:
+            import cProfile
+
+            session = cProfile.Profile()
+            start, stop = session.enable, session.disable
+        sampler.start()
+        start()
+        try:
+            return function(*args)
+        finally:
+            stop()
+            sampler.stop()
+            try:
+                self._write(name, profiler, session, sampler)
+            except Exception as e:
+                logger.error("Could not write profile %s: %s", name, e, exc_info=True)
+
+    def _write(self, name, profiler, session, sampler):
+        if profiler == "pyinstrument":
+            files = {f"{name}.html": session.output_html().encode("utf-8")}
+        else:
+            import marshal
+
+            # The same bytes Profile.dump_stats writes, without a local file
+            session.create_stats()
+            files = {f"{name}.pstats": marshal.dumps(session.stats)}
+        files[f"{name}.collapsed"] = sampler.collapsed().encode("utf-8")
+        for filename, data in files.items():
+            location = self._store(filename, data)
+            logger.info("Wrote %s profile: %s", profiler, location)
+
+    def _store(self, filename, data):
+        if self.output.startswith("s3://"):
+            bucket, prefix = split_s3_url(self.output)
+            key = f"{prefix.rstrip('/')}/{filename}" if prefix else filename
+            self.s3_client.put_object(Bucket=bucket, Key=key, Body=data)
+            return f"s3://{bucket}/{key}"
+        os.makedirs(self.output, exist_ok=True)
+        path = os.path.join(self.output, filename)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+
+if __name__ == "__main__":
+    print(
+        json.dumps(
+            {
+                "profile": sign_profile_flag(
+                    os.environ["PROFILE_SIGNING_KEY"],
+                    sys.argv[1] if len(sys.argv) > 1 else "cprofile",
+                    int(sys.argv[2]) if len(sys.argv) > 2 else 600,
+                )
+            }
+        )
+    )
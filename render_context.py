@@ -0,0 +1,256 @@
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from weasyprint import CSS, HTML, default_url_fetcher
+from weasyprint.text.fonts import FontConfiguration
+
+HEAD_PATTERN = re.compile(r"<head[^>]*>(.*?)</head>", re.DOTALL | re.IGNORECASE)
+BODY_PATTERN = re.compile(r"<body[^>]*>(.*)</body>", re.DOTALL | re.IGNORECASE)
+HEAD_OPEN_PATTERN = re.compile(r"<head(?:\s[^>]*)?>", re.IGNORECASE)
+
+# Added to combined documents: every ticket gets a page of its own, sized by the
+# template's @page rule, and its content keeps the 100% heights it was written for.
+COMBINED_PAGE_CSS = """
+html, body { height: auto !important; }
+.combined-ticket-page { height: 100vh; position: relative; overflow: hidden; break-after: page; }
+.combined-ticket-page:last-child { break-after: auto; }
+"""
+
+# WeasyPrint announces each rendering step on this logger ("Step 3 - Applying
+# CSS", "Step 5 - Creating layout - Page 2", ...). RenderTimings listens to it;
+# the messages themselves are kept out of the function's logs.
+PROGRESS_LOGGER = logging.getLogger("weasyprint.progress")
+PROGRESS_LOGGER.setLevel(logging.INFO)
+PROGRESS_LOGGER.propagate = False
+PROGRESS_STEP_PATTERN = re.compile(r"Step (\d+) ")
+PROGRESS_STEPS = {
+    "1": "HtmlParse",
+    "2": "CssParse",
+    "3": "Cascade",
+    "4": "BoxTree",
+    "5": "Layout",
+    "6": "Draw",
+    "7": "Metadata",
+}
+
+
+class RenderTimings(logging.Handler):
+    """
+    Breaks one render down into WeasyPrint's own steps (HTML parsing, CSS
+    parsing, cascade, box tree, layout, drawing, metadata) by timing the progress
+    messages it logs as each step starts, plus 'Serialize' for writing the PDF
+    file, which starts in the write_pdf() finisher. Durations are in
+    milliseconds in 'phases'; steps that run more than once accumulate.
+    """
+
+    def __init__(self):
+        super().__init__(logging.INFO)
+        self.phases = {}
+        self._phase = None
+        self._phase_started = None
+
+    def emit(self, record):
+        match = PROGRESS_STEP_PATTERN.match(str(record.msg))
+        if match and match.group(1) in PROGRESS_STEPS:
+            self.start(PROGRESS_STEPS[match.group(1)])
+
+    def start(self, phase):
+        now = time.perf_counter()
+        self._end(now)
+        self._phase = phase
+        self._phase_started = now
+
+    def stop(self):
+        self._end(time.perf_counter())
+        self._phase = None
+
+    def finisher(self, document, pdf):
+        self.start("Serialize")
+
+    def _end(self, now):
+        if self._phase is not None:
+            self.phases[self._phase] = self.phases.get(self._phase, 0.0) + (now - self._phase_started) * 1000
+
+
+def w3c_date(value):
+    """
+    Normalizes a datetime or an ISO 8601 string to the UTC W3C date that
+    WeasyPrint reads from dcterms meta tags, e.g. '2025-06-01T18:00:00Z'.
+    Naive values are taken as UTC. Raises ValueError for unparseable strings.
+    """
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.strip())
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def with_document_date(html_content, document_date):
+    """
+    Pins the PDF's /CreationDate and /ModDate to 'document_date' (a w3c_date())
+    by declaring them at the top of <head>: WeasyPrint keeps the first
+    dcterms.created / dcterms.modified it finds, so any in the template are
+    overridden. Documents without a <head> are returned unchanged.
+    """
+    match = HEAD_OPEN_PATTERN.search(html_content)
+    if match is None:
+        return html_content
+    meta = (
+        f'<meta name="dcterms.created" content="{document_date}">'
+        f'<meta name="dcterms.modified" content="{document_date}">'
+    )
+    return html_content[:match.end()] + meta + html_content[match.end():]
+
+
+class CachingURLFetcher:
+    """
+    Wraps a WeasyPrint url_fetcher and keeps the fetched bytes in memory, so
+    images, fonts and imported stylesheets are only resolved once per warm
+    container. Bounded by 'max_bytes' with LRU eviction.
+    """
+
+    def __init__(self, fetcher=default_url_fetcher, max_bytes=32 * 1024 * 1024):
+        self.fetcher = fetcher
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, url, *args, **kwargs):
+        if url.startswith("data:"):
+            return self.fetcher(url, *args, **kwargs)
+
+        with self._lock:
+            cached = self._entries.get(url)
+            if cached is not None:
+                self._entries.move_to_end(url)
+                self.hits += 1
+                return dict(cached)
+
+        result = self.fetcher(url, *args, **kwargs)
+        if "string" not in result:
+            file_obj = result.pop("file_obj")
+            try:
+                result["string"] = file_obj.read()
+            finally:
+                file_obj.close()
+        size = len(result["string"])
+
+        with self._lock:
+            self.misses += 1
+            if size <= self.max_bytes and url not in self._entries:
+                self._entries[url] = dict(result)
+                self._total_bytes += size
+                while self._total_bytes > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._total_bytes -= len(evicted["string"])
+        return result
+
+
+class RenderContext:
+    """
+    Long-lived WeasyPrint state shared by every render in a warm container:
+    one FontConfiguration, a caching url_fetcher (so @import, @font-face and
+    image fetches are done once) and the CSS objects added by the renderer
+    itself, cached by their text.
+
+    A template's own <style> blocks stay in the document: stylesheets passed
+    to WeasyPrint separately are user-origin CSS, which would outrank the rest
+    of the template's author CSS (a <link>ed stylesheet, inline styles)
+    regardless of specificity or order.
+
+    With 'deterministic' set, every PDF gets a /ID derived from its own content
+    instead of none, so together with dates pinned by with_document_date() the
+    same input always produces the same bytes.
+    """
+
+    def __init__(self, url_fetcher=None, max_stylesheets=64, deterministic=False):
+        self.font_config = FontConfiguration()
+        self.url_fetcher = url_fetcher or CachingURLFetcher()
+        self.max_stylesheets = max_stylesheets
+        self.pdf_options = {"pdf_identifier": True} if deterministic else {}
+        self._stylesheets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def stylesheet(self, css_text, base_url):
+        cache_key = (base_url, css_text)
+        with self._lock:
+            css = self._stylesheets.get(cache_key)
+            if css is not None:
+                self._stylesheets.move_to_end(cache_key)
+                return css
+
+        css = CSS(
+            string=css_text,
+            base_url=base_url,
+            url_fetcher=self.url_fetcher,
+            font_config=self.font_config,
+        )
+        with self._lock:
+            self._stylesheets[cache_key] = css
+            while len(self._stylesheets) > self.max_stylesheets:
+                self._stylesheets.popitem(last=False)
+        return css
+
+    def html(self, html_content, base_url):
+        return HTML(string=html_content, base_url=base_url, url_fetcher=self.url_fetcher)
+
+    def write_pdf(self, html_content, base_url, target=None, timings=None):
+        """
+        Renders the document and returns the PDF bytes, or writes them to
+        'target' (a file object such as an S3SpooledWriter) and returns None.
+
+        Layout (render()) and PDF output (Document.write_pdf()) run as separate
+        calls; pass a RenderTimings to get the time spent in each of their steps.
+        """
+        if timings is not None:
+            PROGRESS_LOGGER.addHandler(timings)
+            timings.start("CssParse")
+        try:
+            document = self.html(html_content, base_url).render(font_config=self.font_config)
+            return document.write_pdf(
+                target, finisher=timings.finisher if timings else None, **self.pdf_options
+            )
+        finally:
+            if timings is not None:
+                timings.stop()
+                PROGRESS_LOGGER.removeHandler(timings)
+
+    def write_combined_pdf(self, html_documents, base_url, target=None):
+        """
+        Lays out several rendered tickets as one document (one page per ticket)
+        and writes it with a single write_pdf(), so fonts are embedded and subset
+        once. Every ticket must share the same <head>, i.e. the same styles.
+        Like write_pdf(), returns the bytes unless a 'target' is given.
+        """
+        head = _match_group(HEAD_PATTERN, html_documents[0], "<head>")
+        pages = []
+        for html_content in html_documents:
+            if _match_group(HEAD_PATTERN, html_content, "<head>") != head:
+                raise ValueError(
+                    "Combined output needs every ticket to share the same <head> (styles)."
+                )
+            body = _match_group(BODY_PATTERN, html_content, "<body>")
+            pages.append(f'<div class="combined-ticket-page">{body}</div>')
+
+        # User-origin on purpose: its !important heights beat the template's
+        stylesheets = [self.stylesheet(COMBINED_PAGE_CSS, base_url)]
+        combined_html = (
+            f"<!DOCTYPE html><html><head>{head}</head><body>{''.join(pages)}</body></html>"
+        )
+        return self.html(combined_html, base_url).write_pdf(
+            target, stylesheets=stylesheets, font_config=self.font_config, **self.pdf_options
+        )
+
+
+def _match_group(pattern, html_content, name):
+    match = pattern.search(html_content)
+    if match is None:
+        raise ValueError(f"Ticket HTML has no {name} element.")
+    return match.group(1)
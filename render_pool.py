@@ -0,0 +1,162 @@
+import logging
+import multiprocessing
+import os
+import threading
+from multiprocessing.connection import wait
+
+logger = logging.getLogger("ticket_pdf")
+
+
+# Lambda's CPU quota is one full vCPU per this much configured memory
+LAMBDA_MB_PER_VCPU = 1769
+
+
+def available_cpus():
+    """
+    CPUs worth a render process each. Inside Lambda the affinity mask shows
+    two or more vCPUs even at small memory sizes, where the CPU quota is below
+    one, so there the count comes from AWS_LAMBDA_FUNCTION_MEMORY_SIZE.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    memory_mb = os.environ.get("AWS_LAMBDA_FUNCTION_MEMORY_SIZE")
+    if memory_mb:
+        cpus = min(cpus, max(1, int(memory_mb) // LAMBDA_MB_PER_VCPU))
+    return cpus
+
+
+def _worker_main(conn, render_fn, initializer):
+    if initializer is not None:
+        initializer()
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        if message is None:
+            break
+        job_id, args = message
+        try:
+            reply = (job_id, True, render_fn(*args))
+        except Exception as e:
+            reply = (job_id, False, f"{type(e).__name__}: {e}")
+        conn.send(reply)
+    conn.close()
+
+
+class _Worker:
+    __slots__ = ("process", "conn")
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+
+
+class RenderPool:
+    """
+    Pre-forked pool of render processes for multi-vCPU Lambda sizes.
+
+    multiprocessing.Pool and Queue need POSIX semaphores, which Lambda cannot
+    provide (there is no /dev/shm), so this is built on plain Process + Pipe
+    only. Workers are forked from the fully imported parent, so WeasyPrint and
+    the render context are already loaded in every child; each worker runs
+    'render_fn(*args)' for one job at a time and sends the result back.
+    """
+
+    def __init__(self, render_fn, size=None, initializer=None):
+        self.render_fn = render_fn
+        self.size = size or available_cpus()
+        self.initializer = initializer
+        self._workers = []
+        self._lock = threading.Lock()
+        self._context = multiprocessing.get_context("fork")
+
+    @property
+    def started(self):
+        return bool(self._workers)
+
+    def pids(self):
+        return [worker.process.pid for worker in self._workers]
+
+    def start(self):
+        with self._lock:
+            while len(self._workers) < self.size:
+                self._workers.append(self._spawn())
+        logger.info("Render pool started with %s worker processes.", self.size)
+
+    def imap_unordered(self, jobs):
+        """
+        Runs every job (a tuple of render_fn arguments) on the pool and yields
+        (index, ok, result) as workers finish, where 'result' is the return
+        value or, if ok is False, the error message.
+        """
+        with self._lock:
+            pending = enumerate(jobs)
+            idle = list(self._workers)
+            busy = {}
+            try:
+                while True:
+                    while idle:
+                        job = next(pending, None)
+                        if job is None:
+                            break
+                        worker = idle.pop()
+                        worker.conn.send(job)
+                        busy[worker.conn] = (worker, job[0])
+                    if not busy:
+                        return
+
+                    for conn in wait(list(busy)):
+                        worker, job_id = busy.pop(conn)
+                        try:
+                            reply = conn.recv()
+                        except (EOFError, OSError):
+                            worker = self._replace(worker)
+                            reply = (job_id, False, "Render worker process exited unexpectedly.")
+                        idle.append(worker)
+                        yield reply
+            finally:
+                # If the consumer stopped early, drain in-flight jobs so the
+                # next caller doesn't receive stale replies.
+                for conn, (worker, _) in list(busy.items()):
+                    try:
+                        conn.recv()
+                    except (EOFError, OSError):
+                        self._replace(worker)
+
+    def close(self):
+        with self._lock:
+            for worker in self._workers:
+                try:
+                    worker.conn.send(None)
+                except OSError:
+                    pass
+            for worker in self._workers:
+                worker.process.join(timeout=5)
+                if worker.process.is_alive():
+                    worker.process.kill()
+                worker.conn.close()
+            self._workers = []
+
+    def _spawn(self):
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(child_conn, self.render_fn, self.initializer),
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        return _Worker(process, parent_conn)
+
+    def _replace(self, worker):
+        # Must be called with self._lock held
+        worker.conn.close()
+        if worker.process.is_alive():
+            worker.process.kill()
+        worker.process.join()
+        replacement = self._spawn()
+        self._workers[self._workers.index(worker)] = replacement
+        return replacement
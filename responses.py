@@ -0,0 +1,124 @@
+import binascii
+import json
+
+try:
+    import orjson
+except ImportError:  # optional: only speeds up serializing the small JSON envelope
+    orjson = None
+
+# How a single ticket is handed back to the caller:
+#   inline  JSON with the PDF as 'pdf_base64' (falls back to 'url' when too big)
+#   url     JSON with a presigned GET URL for the uploaded object
+#   binary  the PDF itself, Base64-encoded with isBase64Encoded for API Gateway
+#           binary media types (a redirect to the presigned URL when too big)
+RESPONSE_MODES = ("inline", "url", "binary")
+
+# Lambda's limit on a synchronous response payload
+MAX_RESPONSE_BYTES = 6 * 1024 * 1024
+# Headroom kept for the JSON envelope and headers around the Base64 payload
+RESPONSE_ENVELOPE_RESERVE = 16 * 1024
+# Input bytes Base64-encoded per step; a multiple of 3, so the encoded chunks
+# join up without padding in between
+ENCODE_CHUNK_BYTES = 3 * 256 * 1024
+
+
+def base64_length(size):
+    """Length of the Base64 encoding of 'size' bytes."""
+    return 4 * ((size + 2) // 3)
+
+
+def encode_base64_into(buffer, offset, data):
+    """
+    Base64-encodes 'data' into 'buffer' from 'offset' on, a chunk at a time, so
+    no full-size intermediate is created. Returns the offset after the output.
+    """
+    view = memoryview(data)
+    for start in range(0, len(view), ENCODE_CHUNK_BYTES):
+        encoded = binascii.b2a_base64(view[start:start + ENCODE_CHUNK_BYTES], newline=False)
+        buffer[offset:offset + len(encoded)] = encoded
+        offset += len(encoded)
+    return offset
+
+
+def base64_text(data):
+    buffer = bytearray(base64_length(len(data)))
+    encode_base64_into(buffer, 0, data)
+    return buffer.decode("ascii")
+
+
+def json_with_base64(fields, name, data):
+    """
+    Serializes 'fields' plus the Base64 encoding of 'data' under 'name' as one
+    JSON object. The envelope and the encoded payload are written straight into
+    a buffer allocated at its final size, so the Base64 text never exists as
+    separate bytes / str / json.dumps copies; the only full-size copy is the
+    returned str.
+    """
+    envelope = _dumps(fields)
+    prefix = envelope[:-1] + (b"," if len(envelope) > 2 else b"") + _dumps(name) + b':"'
+    suffix = b'"}'
+    buffer = bytearray(len(prefix) + base64_length(len(data)) + len(suffix))
+    buffer[:len(prefix)] = prefix
+    offset = encode_base64_into(buffer, len(prefix), data)
+    buffer[offset:] = suffix
+    return buffer.decode("utf-8")
+
+
+def _dumps(value):
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value).encode("utf-8")
+
+
+def fits_in_response(pdf_size, max_bytes=MAX_RESPONSE_BYTES):
+    return base64_length(pdf_size) + RESPONSE_ENVELOPE_RESERVE <= max_bytes
+
+
+def presigned_url(s3_client, bucket, key, expires_in):
+    """
+    A GET URL for the object that needs no credentials. Signed with the
+    function's role, so it stops working early if that session expires first.
+    """
+    return s3_client.generate_presigned_url(
+        "get_object", Params={"Bucket": bucket, "Key": key}, ExpiresIn=expires_in
+    )
+
+
+def json_response(fields, status_code=200):
+    return {
+        "statusCode": status_code,
+        "headers": {"Content-Type": "application/json"},
+        "body": json.dumps(fields),
+    }
+
+
+def inline_response(fields, pdf_bytes):
+    return {
+        "statusCode": 200,
+        "headers": {"Content-Type": "application/json"},
+        "body": json_with_base64(dict(fields, response_mode="inline"), "pdf_base64", pdf_bytes),
+    }
+
+
+def url_response(fields, url, expires_in):
+    return json_response(dict(fields, response_mode="url", pdf_url=url, url_expires_in=expires_in))
+
+
+def binary_response(pdf_bytes, filename, headers=None):
+    headers = dict(headers or {})
+    headers["Content-Type"] = "application/pdf"
+    headers["Content-Disposition"] = 'inline; filename="{}"'.format(filename.replace('"', ""))
+    return {
+        "statusCode": 200,
+        "headers": headers,
+        "isBase64Encoded": True,
+        "body": base64_text(pdf_bytes),
+    }
+
+
+def redirect_response(url, headers=None):
+    return {
+        "statusCode": 303,
+        "headers": dict(headers or {}, Location=url),
+        "body": "",
+    }
@@ -0,0 +1,162 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from botocore.exceptions import ClientError
+
+# Bump when a code change alters the PDF produced for the same inputs
+RENDER_CACHE_VERSION = 3
+
+
+def render_cache_key(template_etag, variable_substitutions, options):
+    """
+    Content address of a rendered ticket: the template version, the final
+    substitution map (colors included) and any option that changes the output.
+    """
+    material = json.dumps(
+        {
+            "version": RENDER_CACHE_VERSION,
+            "template_etag": template_etag,
+            "variables": variable_substitutions,
+            "options": options,
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class RenderResultCache:
+    """
+    Two-tier cache of rendered PDFs keyed by render_cache_key():
+
+    - a local tier under 'cache_dir' (/tmp), LRU-bounded by 'max_local_bytes';
+    - an S3 tier under '{prefix}{key}.pdf', probed with a HEAD request.
+
+    find() reports which tier answered; hit counters are kept per tier, and
+    lookups or stores that failed (record_error) are counted as 'error'.
+    """
+
+    def __init__(self, s3_client, bucket, prefix="render-cache/", cache_dir="/tmp/render-cache", max_local_bytes=256 * 1024 * 1024):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.cache_dir = cache_dir
+        self.max_local_bytes = max_local_bytes
+        self._local = OrderedDict()
+        self._local_bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"local": 0, "s3": 0, "miss": 0, "bypass": 0, "error": 0}
+
+    def remote_key(self, key):
+        return f"{self.prefix}{key}.pdf"
+
+    def find(self, key):
+        """
+        Returns (tier, pdf_bytes): ('local', bytes) from /tmp, ('s3', None) when
+        only the S3 object exists (see read_remote), or ('miss', None).
+        """
+        pdf_bytes = self._read_local(key)
+        if pdf_bytes is not None:
+            self._count("local")
+            return "local", pdf_bytes
+        try:
+            self.s3_client.head_object(Bucket=self.bucket, Key=self.remote_key(key))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") not in ("404", "NoSuchKey", "NotFound"):
+                raise
+            self._count("miss")
+            return "miss", None
+        self._count("s3")
+        return "s3", None
+
+    def read_remote(self, key):
+        s3_response = self.s3_client.get_object(Bucket=self.bucket, Key=self.remote_key(key))
+        pdf_bytes = s3_response["Body"].read()
+        self._write_local(key, pdf_bytes)
+        return pdf_bytes
+
+    def store(self, key, pdf_bytes, source_key=None):
+        """
+        Adds a freshly rendered PDF to both tiers. If the same bytes were just
+        uploaded to 'source_key', the S3 tier is filled with a server-side copy;
+        'pdf_bytes' may then be None (a PDF streamed to S3), which skips /tmp.
+        """
+        if pdf_bytes is not None:
+            self._write_local(key, pdf_bytes)
+        if source_key:
+            self.s3_client.copy_object(
+                Bucket=self.bucket,
+                Key=self.remote_key(key),
+                CopySource={"Bucket": self.bucket, "Key": source_key},
+            )
+        else:
+            self.s3_client.put_object(
+                Bucket=self.bucket,
+                Key=self.remote_key(key),
+                Body=pdf_bytes,
+                ContentType="application/pdf",
+            )
+
+    def record_bypass(self):
+        self._count("bypass")
+
+    def record_error(self):
+        self._count("error")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, local_entries=len(self._local), local_bytes=self._local_bytes)
+        lookups = stats["local"] + stats["s3"] + stats["miss"]
+        stats["hit_rate"] = (stats["local"] + stats["s3"]) / lookups if lookups else 0.0
+        return stats
+
+    def _count(self, outcome):
+        with self._lock:
+            self._stats[outcome] += 1
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".pdf")
+
+    def _read_local(self, key):
+        with self._lock:
+            if key not in self._local:
+                return None
+            self._local.move_to_end(key)
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except OSError:
+            with self._lock:
+                self._local_bytes -= self._local.pop(key, 0)
+            return None
+
+    def _write_local(self, key, pdf_bytes):
+        size = len(pdf_bytes)
+        if size > self.max_local_bytes:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{self._path(key)}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(pdf_bytes)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            # /tmp is a cache, not a requirement
+            return
+        evicted = []
+        with self._lock:
+            self._local_bytes -= self._local.pop(key, 0)
+            self._local[key] = size
+            self._local_bytes += size
+            while self._local_bytes > self.max_local_bytes:
+                old_key, old_size = self._local.popitem(last=False)
+                self._local_bytes -= old_size
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
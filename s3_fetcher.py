@@ -0,0 +1,203 @@
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, uses_netloc, uses_relative
+
+from botocore.exceptions import ClientError
+
+from template_cache import is_not_modified
+
+# WeasyPrint resolves relative URLs with urllib's urljoin, which ignores base
+# URLs whose scheme it doesn't know. Register s3:// so that 'logo.png' under
+# base_url 's3://bucket/' resolves to 's3://bucket/logo.png'.
+for _registry in (uses_relative, uses_netloc):
+    if "s3" not in _registry:
+        _registry.append("s3")
+
+# src="...", href="..." and CSS url(...) references in a template
+ASSET_REFERENCE_PATTERN = re.compile(
+    r"""(?:src|href)\s*=\s*["']([^"']+)["']|url\(\s*["']?([^"')]+?)["']?\s*\)"""
+)
+
+
+def split_s3_url(url):
+    bucket, _, key = url[len("s3://"):].partition("/")
+    return bucket, key
+
+
+class _Asset:
+    __slots__ = ("body", "etag", "mime_type", "fetched_at")
+
+    def __init__(self, body, etag, mime_type):
+        self.body = body
+        self.etag = etag
+        self.mime_type = mime_type
+        self.fetched_at = time.monotonic()
+
+
+class S3URLFetcher:
+    """
+    WeasyPrint url_fetcher for s3:// URLs, going through the shared s3_client.
+    Any other URL is handed to 'fallback'.
+
+    Assets are cached in memory (LRU, 'max_memory_bytes') and on local disk
+    under 'cache_dir', keyed by ETag. Entries younger than 'ttl_seconds' cost
+    no S3 call at all; older ones are revalidated with a conditional GET, and
+    a 304 is answered from memory or disk.
+    """
+
+    def __init__(
+        self,
+        s3_client,
+        fallback,
+        cache_dir="/tmp/s3-assets",
+        max_memory_bytes=32 * 1024 * 1024,
+        ttl_seconds=60,
+        max_workers=8,
+    ):
+        self.s3_client = s3_client
+        self.fallback = fallback
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.ttl_seconds = ttl_seconds
+        self.max_workers = max_workers
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"hit": 0, "miss": 0, "revalidated": 0, "disk": 0}
+
+    def __call__(self, url, *args, **kwargs):
+        if not url.startswith("s3://"):
+            return self.fallback(url, *args, **kwargs)
+        asset = self.get(url)
+        return {"string": asset.body, "mime_type": asset.mime_type, "redirected_url": url}
+
+    def get(self, url):
+        with self._lock:
+            asset = self._entries.get(url)
+            if asset is not None:
+                self._entries.move_to_end(url)
+                if time.monotonic() - asset.fetched_at < self.ttl_seconds:
+                    self.stats["hit"] += 1
+                    return asset
+
+        if asset is None:
+            asset = self._read_disk(url)
+            if asset is not None:
+                self.stats["disk"] += 1
+
+        bucket, key = split_s3_url(url)
+        params = {"Bucket": bucket, "Key": key}
+        if asset is not None and asset.etag:
+            params["IfNoneMatch"] = asset.etag
+        try:
+            s3_response = self.s3_client.get_object(**params)
+        except ClientError as e:
+            if asset is None or not is_not_modified(e):
+                raise
+            asset.fetched_at = time.monotonic()
+            self.stats["revalidated"] += 1
+        else:
+            asset = _Asset(
+                s3_response["Body"].read(),
+                s3_response.get("ETag"),
+                _guess_mime_type(key, s3_response.get("ContentType")),
+            )
+            self.stats["miss"] += 1
+            self._write_disk(url, asset)
+
+        self._store(url, asset)
+        return asset
+
+    def prefetch(self, html_content, base_url):
+        """
+        Fetches every s3:// asset referenced by the document in parallel, so
+        WeasyPrint's (sequential) fetches during layout are all memory hits.
+        """
+        urls = set()
+        for match in ASSET_REFERENCE_PATTERN.finditer(html_content):
+            reference = match.group(1) or match.group(2)
+            if reference.startswith(("data:", "#")):
+                continue
+            url = urljoin(base_url, reference.strip())
+            if url.startswith("s3://") and not url.endswith("/"):
+                urls.add(url)
+        if not urls:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(urls))) as executor:
+            return list(executor.map(self._prefetch_one, sorted(urls)))
+
+    def _prefetch_one(self, url):
+        try:
+            self.get(url)
+            return url, None
+        except Exception as e:
+            # Left for WeasyPrint to report when (and if) it actually needs it
+            return url, str(e)
+
+    def _store(self, url, asset):
+        size = len(asset.body)
+        with self._lock:
+            previous = self._entries.pop(url, None)
+            if previous is not None:
+                self._total_bytes -= len(previous.body)
+            if size > self.max_memory_bytes:
+                return
+            self._entries[url] = asset
+            self._total_bytes += size
+            while self._total_bytes > self.max_memory_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= len(evicted.body)
+
+    def _disk_paths(self, url):
+        digest = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return (
+            os.path.join(self.cache_dir, digest + ".json"),
+            os.path.join(self.cache_dir, digest + ".bin"),
+        )
+
+    def _read_disk(self, url):
+        meta_path, body_path = self._disk_paths(url)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            with open(body_path, "rb") as f:
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        asset = _Asset(body, meta["etag"], meta["mime_type"])
+        # Force a revalidation before first use
+        asset.fetched_at = float("-inf")
+        return asset
+
+    def _write_disk(self, url, asset):
+        if not asset.etag:
+            return
+        meta_path, body_path = self._disk_paths(url)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Body first, then metadata: a reader never sees an ETag for a
+            # body that hasn't been fully written.
+            tmp_path = f"{body_path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(asset.body)
+            os.replace(tmp_path, body_path)
+            tmp_path = f"{meta_path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"etag": asset.etag, "mime_type": asset.mime_type}, f)
+            os.replace(tmp_path, meta_path)
+        except OSError:
+            # /tmp is a cache, not a requirement
+            pass
+
+
+def _guess_mime_type(key, content_type):
+    if content_type and content_type not in ("binary/octet-stream", "application/octet-stream"):
+        return content_type.split(";", 1)[0]
+    return mimetypes.guess_type(key)[0] or "application/octet-stream"
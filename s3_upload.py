@@ -0,0 +1,272 @@
+import logging
+import shutil
+import tempfile
+from collections import deque
+from concurrent.futures import wait
+
+logger = logging.getLogger("ticket_pdf")
+
+# S3 rejects multipart parts smaller than 5 MiB (except the last one)
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+class S3MultipartWriter:
+    """
+    Write-only file object that uploads to S3 with a multipart upload as parts
+    fill up, so only about one part is ever held in memory.
+
+    The upload is created on the first full part; if less than one part is ever
+    written, close() falls back to a single put_object. Call abort() (or use it
+    as a context manager, which aborts on error) to discard a failed upload.
+    Provides tell() but not seek(), which zipfile treats as a non-seekable stream.
+
+    Given an 'executor', parts are uploaded on it while the caller keeps
+    writing, with at most 'max_in_flight' parts uploading at once (write()
+    waits for the oldest beyond that), so memory stays bounded at about
+    max_in_flight + 1 parts. Without one, write() uploads each part itself.
+    """
+
+    def __init__(self, s3_client, bucket, key, part_size=8 * 1024 * 1024, content_type=None, executor=None, max_in_flight=2):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.content_type = content_type
+        self.executor = executor
+        self.max_in_flight = max(max_in_flight, 1)
+        self.upload_id = None
+        self.closed = False
+        self._parts = []
+        self._in_flight = deque()
+        self._part_count = 0
+        self._buffer = bytearray()
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("write to closed S3MultipartWriter")
+        self._buffer += data
+        self._position += len(data)
+        while len(self._buffer) >= self.part_size:
+            self._upload_part(bytes(self._buffer[: self.part_size]))
+            del self._buffer[: self.part_size]
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """Uploads whatever is buffered and completes the upload."""
+        if self.closed:
+            return
+        self.closed = True
+        extra = {"ContentType": self.content_type} if self.content_type else {}
+        if self.upload_id is None:
+            self.s3_client.put_object(
+                Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer), **extra
+            )
+        else:
+            try:
+                if self._buffer:
+                    self._upload_part(bytes(self._buffer))
+                while self._in_flight:
+                    self._finish_oldest_part()
+            except Exception:
+                self.abort()
+                raise
+            self.s3_client.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self.upload_id,
+                MultipartUpload={"Parts": self._parts},
+            )
+        self._buffer = bytearray()
+        logger.info(
+            "Uploaded s3://%s/%s (%s bytes, %s part(s)).",
+            self.bucket,
+            self.key,
+            self._position,
+            max(len(self._parts), 1),
+        )
+
+    def abort(self):
+        self.closed = True
+        self._buffer = bytearray()
+        # Let running part uploads end first, or they could recreate parts
+        # after the abort
+        wait([future for _, future in self._in_flight])
+        self._in_flight.clear()
+        if self.upload_id is not None:
+            self.s3_client.abort_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id
+            )
+            self.upload_id = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _upload_part(self, data):
+        if self.upload_id is None:
+            extra = {"ContentType": self.content_type} if self.content_type else {}
+            self.upload_id = self.s3_client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, **extra
+            )["UploadId"]
+        self._part_count += 1
+        part_args = dict(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=self._part_count,
+            Body=data,
+        )
+        if self.executor is None:
+            response = self.s3_client.upload_part(**part_args)
+            self._parts.append({"ETag": response["ETag"], "PartNumber": self._part_count})
+            return
+        while len(self._in_flight) >= self.max_in_flight:
+            self._finish_oldest_part()
+        self._in_flight.append(
+            (self._part_count, self.executor.submit(self.s3_client.upload_part, **part_args))
+        )
+
+    def _finish_oldest_part(self):
+        part_number, future = self._in_flight.popleft()
+        # Parts complete in order of submission, so _parts stays sorted
+        self._parts.append({"ETag": future.result()["ETag"], "PartNumber": part_number})
+
+
+class S3SpooledWriter:
+    """
+    Write-only file object for one S3 object whose final size isn't known up
+    front, such as a PDF being serialized.
+
+    Output is spooled (in memory, then in /tmp past 'spool_size') until it
+    grows past 'threshold'. From then on the spooled bytes become the first
+    parts of a multipart upload and later writes stream through an
+    S3MultipartWriter, so a large document never has to fit in memory. Output
+    that stays below the threshold is sent with one put_object on close() and
+    remains available from getvalue(). Nothing is uploaded if nothing was written.
+
+    Given an 'executor', multipart parts upload on it while serialization goes
+    on (see S3MultipartWriter), and close() submits the single put_object to it
+    and returns at once; that future is left in 'upload' for the caller to join
+    (it stays None when close() finished the upload itself). Without one, each
+    part uploads inside write() and the serializer waits for it.
+    """
+
+    def __init__(
+        self,
+        s3_client,
+        bucket,
+        key,
+        threshold=8 * 1024 * 1024,
+        part_size=8 * 1024 * 1024,
+        content_type=None,
+        spool_size=16 * 1024 * 1024,
+        executor=None,
+    ):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.threshold = threshold
+        self.part_size = part_size
+        self.content_type = content_type
+        self.executor = executor
+        self.upload = None
+        self.closed = False
+        self._spool = tempfile.SpooledTemporaryFile(max_size=spool_size)
+        self._multipart = None
+        self._value = None
+        self._position = 0
+
+    @property
+    def streamed(self):
+        """True once the output went past the threshold into a multipart upload."""
+        return self._multipart is not None
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("write to closed S3SpooledWriter")
+        self._position += len(data)
+        if self._multipart is not None:
+            return self._multipart.write(data)
+        self._spool.write(data)
+        if self._position > self.threshold:
+            self._start_multipart()
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        """The uploaded bytes after close(), or None if they were streamed."""
+        return self._value
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self._multipart is not None:
+            self._multipart.close()
+        elif self._position:
+            self._spool.seek(0)
+            self._value = self._spool.read()
+            extra = {"ContentType": self.content_type} if self.content_type else {}
+            put_object_args = dict(Bucket=self.bucket, Key=self.key, Body=self._value, **extra)
+            if self.executor is not None:
+                self.upload = self.executor.submit(self.s3_client.put_object, **put_object_args)
+            else:
+                self.s3_client.put_object(**put_object_args)
+        self._spool.close()
+
+    def abort(self):
+        self.closed = True
+        if self._multipart is not None:
+            self._multipart.abort()
+        self._spool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _start_multipart(self):
+        self._multipart = S3MultipartWriter(
+            self.s3_client,
+            self.bucket,
+            self.key,
+            part_size=self.part_size,
+            content_type=self.content_type,
+            executor=self.executor,
+        )
+        self._spool.seek(0)
+        shutil.copyfileobj(self._spool, self._multipart, self._multipart.part_size)
+        self._spool.close()
+        logger.info(
+            "Output for s3://%s/%s passed %s bytes, streaming it as a multipart upload.",
+            self.bucket,
+            self.key,
+            self.threshold,
+        )
@@ -0,0 +1,170 @@
+"""
+Structured JSON logging for the Lambda entry points.
+
+Every record becomes one JSON object per line ({"level", "message",
+"request_id", ...} plus any 'extra' fields), which CloudWatch Logs Insights can
+filter on directly. Messages use %-style arguments so nothing is formatted for
+records below the active level, and large values (payloads, HTML) go through
+Truncated, which only renders and truncates them if the record is emitted.
+
+Verbose logging is sampled per request: a fixed share of request ids (chosen
+deterministically, so every line of a sampled request is kept) run at DEBUG,
+the rest at the configured level. Only the application's own logger goes to
+DEBUG; library loggers (botocore, urllib3, fontTools, ...) stay at the
+configured level on the root logger, so a sampled request does not log every
+HTTP exchange.
+"""
+import functools
+import hashlib
+import json
+import logging
+import time
+
+# Attributes every LogRecord has; anything else on a record came from 'extra'
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message",
+    "asctime",
+    "aws_request_id",
+}
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, request_logging=None):
+        super().__init__()
+        self.request_logging = request_logging
+
+    def format(self, record):
+        entry = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created))
+            + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "logger": record.name or "root",
+        }
+        request_id = getattr(record, "aws_request_id", None)
+        if request_id is None and self.request_logging is not None:
+            request_id = self.request_logging.request_id
+        if request_id:
+            entry["request_id"] = request_id
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES:
+                entry[name] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class Truncated:
+    """
+    Log argument for a potentially large value: rendered (JSON for anything but
+    a str) and cut to 'limit' characters only when the record is emitted.
+    """
+
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value, limit):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self):
+        text = self.value if isinstance(self.value, str) else json.dumps(self.value, default=str)
+        if len(text) <= self.limit:
+            return text
+        return f"{text[:self.limit]}... [{len(text) - self.limit} more chars]"
+
+
+class Lazy:
+    """Log argument computed by calling 'function' only when the record is emitted."""
+
+    __slots__ = ("function",)
+
+    def __init__(self, function):
+        self.function = function
+
+    def __str__(self):
+        return str(self.function())
+
+
+def level_number(level, default=logging.INFO):
+    """A level given as a number or a name ("debug", "WARNING"), or 'default' if unknown."""
+    if isinstance(level, int):
+        return level
+    number = logging.getLevelName(str(level).strip().upper())
+    # getLevelName returns "Level X" for names it does not know
+    return number if isinstance(number, int) else default
+
+
+def is_sampled(request_id, sample_rate):
+    """Deterministic per-request sampling: the same id always gets the same answer."""
+    if not request_id or sample_rate <= 0:
+        return False
+    digest = hashlib.sha256(request_id.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2**64 < sample_rate
+
+
+class RequestLogging:
+    """
+    Per-invocation logging state for the application's 'logger' (a named
+    logger; its records propagate to the root logger's handlers): the current
+    request id, and whether this request was sampled for verbose (DEBUG)
+    logging. 'level' is a number or a level name; an unknown name falls back
+    to INFO.
+    """
+
+    def __init__(self, logger, level=logging.INFO, sample_rate=0.01, max_body_chars=2048):
+        self.logger = logger
+        self.level = level_number(level)
+        self.unknown_level = None if level_number(level, None) is not None else level
+        self.sample_rate = sample_rate
+        self.max_body_chars = max_body_chars
+        self.request_id = None
+        self.sampled = False
+
+    def install(self):
+        """
+        Switches the root logger's handlers (or a new stderr handler) to
+        JsonFormatter and sets the root and application loggers to 'level'.
+        """
+        root = logging.getLogger()
+        if not root.handlers:
+            root.addHandler(logging.StreamHandler())
+        for handler in root.handlers:
+            handler.setFormatter(JsonFormatter(self))
+        root.setLevel(self.level)
+        self.logger.setLevel(self.level)
+        if self.unknown_level is not None:
+            self.logger.warning(
+                "Unknown log level %r; using %s", self.unknown_level, logging.getLevelName(self.level)
+            )
+
+    def begin(self, context):
+        self.request_id = getattr(context, "aws_request_id", None)
+        self.sampled = is_sampled(self.request_id, self.sample_rate)
+        self.logger.setLevel(logging.DEBUG if self.sampled else self.level)
+
+    def end(self):
+        self.logger.setLevel(self.level)
+        self.request_id = None
+        self.sampled = False
+
+    def body(self, value):
+        return Truncated(value, self.max_body_chars)
+
+    def handler(self, function):
+        """
+        Decorates a Lambda entry point: starts the request's logging state and,
+        at DEBUG, logs the incoming event and the response (truncated).
+        """
+
+        @functools.wraps(function)
+        def wrapper(event, context):
+            self.begin(context)
+            try:
+                self.logger.debug("Received event: %s", self.body(event), extra={"sampled": self.sampled})
+                response = function(event, context)
+                self.logger.debug("Returning response: %s", self.body(response))
+                return response
+            finally:
+                self.end()
+
+        return wrapper
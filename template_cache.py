@@ -0,0 +1,137 @@
+import threading
+import time
+from collections import OrderedDict
+
+from botocore.exceptions import ClientError
+
+
+class TemplateEntry:
+    """
+    A single cached template: the decoded HTML, the ETag and LastModified it
+    was fetched with, and a 'derived' dict for anything computed from the HTML (compiled
+    placeholders, parsed CSS, ...) so it is dropped together with the HTML
+    whenever the object changes in S3.
+    """
+
+    __slots__ = ("bucket", "key", "html", "etag", "size", "last_modified", "fetched_at", "derived")
+
+    def __init__(self, bucket, key, html, etag, size, last_modified=None):
+        self.bucket = bucket
+        self.key = key
+        self.html = html
+        self.etag = etag
+        self.size = size
+        self.last_modified = last_modified
+        self.fetched_at = time.monotonic()
+        self.derived = {}
+
+
+class TemplateCache:
+    """
+    Module-level template cache that survives warm Lambda invocations.
+
+    Entries are kept in LRU order and evicted once the total size of the raw
+    template bodies exceeds 'max_bytes'. An entry younger than 'ttl_seconds'
+    is served without touching S3; an older entry is revalidated with a
+    conditional GET (IfNoneMatch on the stored ETag), which costs a round-trip
+    but no body transfer when the template is unchanged.
+    """
+
+    def __init__(self, max_bytes, ttl_seconds):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            "hit": 0,
+            "miss": 0,
+            "revalidated": 0,
+            "refreshed": 0,
+            "evicted": 0,
+        }
+
+    def get(self, s3_client, bucket, key):
+        """
+        Returns (entry, outcome) where outcome is one of 'hit', 'miss',
+        'revalidated' (304 from S3) or 'refreshed' (ETag changed).
+        """
+        cache_key = (bucket, key)
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None:
+                self._entries.move_to_end(cache_key)
+                if time.monotonic() - entry.fetched_at < self.ttl_seconds:
+                    self._stats["hit"] += 1
+                    return entry, "hit"
+
+        if entry is None:
+            new_entry = self._fetch(s3_client, bucket, key)
+            outcome = "miss"
+        else:
+            try:
+                new_entry = self._fetch(s3_client, bucket, key, if_none_match=entry.etag)
+                outcome = "refreshed"
+            except ClientError as e:
+                if not is_not_modified(e):
+                    raise
+                entry.fetched_at = time.monotonic()
+                new_entry = entry
+                outcome = "revalidated"
+
+        with self._lock:
+            self._stats[outcome] += 1
+            if new_entry is not entry:
+                self._store(cache_key, new_entry)
+        return new_entry, outcome
+
+    def invalidate(self, bucket, key):
+        with self._lock:
+            entry = self._entries.pop((bucket, key), None)
+            if entry is not None:
+                self._total_bytes -= entry.size
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                self._stats,
+                entries=len(self._entries),
+                bytes=self._total_bytes,
+                max_bytes=self.max_bytes,
+            )
+
+    def _fetch(self, s3_client, bucket, key, if_none_match=None):
+        params = {"Bucket": bucket, "Key": key}
+        if if_none_match:
+            params["IfNoneMatch"] = if_none_match
+        s3_response = s3_client.get_object(**params)
+        raw = s3_response["Body"].read()
+        return TemplateEntry(
+            bucket,
+            key,
+            raw.decode("utf-8"),
+            s3_response.get("ETag"),
+            len(raw),
+            s3_response.get("LastModified"),
+        )
+
+    def _store(self, cache_key, entry):
+        # Must be called with self._lock held
+        previous = self._entries.pop(cache_key, None)
+        if previous is not None:
+            self._total_bytes -= previous.size
+        if entry.size > self.max_bytes:
+            # Larger than the whole budget: serve it, but don't cache it
+            return
+        self._entries[cache_key] = entry
+        self._total_bytes += entry.size
+        while self._total_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._total_bytes -= evicted.size
+            self._stats["evicted"] += 1
+
+
+def is_not_modified(error):
+    code = str(error.response.get("Error", {}).get("Code", ""))
+    status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+    return code in ("304", "NotModified") or status == 304
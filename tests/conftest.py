@@ -0,0 +1,10 @@
+import os
+import sys
+
+# The Lambda modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# lambda_function builds its clients and render pool at import time: keep the
+# pool from forking and give boto3 a region
+os.environ.setdefault("RENDER_POOL_SIZE", "1")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
@@ -0,0 +1,131 @@
+import io
+import json
+
+import pytest
+
+pytest.importorskip("botocore")
+
+from botocore.exceptions import ClientError
+
+from checkpoint import CheckpointStore, TimeBudget
+
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = Body
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        return {"Body": io.BytesIO(self.objects[Key])}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop(Key, None)
+
+
+class FakeContext:
+    def __init__(self, remaining_ms):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+class RoundBudget:
+    """A budget that runs out after 'rounds' rounds."""
+
+    def __init__(self, rounds):
+        self.rounds = rounds
+
+    def exhausted(self):
+        self.rounds -= 1
+        return self.rounds < 0
+
+    def record_round(self, seconds):
+        pass
+
+    def remaining_ms(self):
+        return 0
+
+
+def test_save_load_delete():
+    store = CheckpointStore(FakeS3(), "bucket")
+    token = store.new_token()
+    store.save(token, {"cursor": 3})
+    assert store.load(token) == {"cursor": 3}
+    store.delete(token)
+    with pytest.raises(LookupError):
+        store.load(token)
+
+
+@pytest.mark.parametrize("token", ["", "../job", "ABC", 12, None, ["abc"], {"token": "abc"}])
+def test_malformed_token(token):
+    with pytest.raises(ValueError):
+        CheckpointStore(FakeS3(), "bucket").load(token)
+
+
+def test_time_budget():
+    context = FakeContext(10_000)
+    budget = TimeBudget(context, reserve_ms=2_000)
+    assert not budget.exhausted()
+    budget.record_round(5)
+    assert not budget.exhausted()
+    context.remaining_ms = 6_999
+    assert budget.exhausted()
+    assert not TimeBudget(None, reserve_ms=2_000).exhausted()
+
+
+@pytest.fixture
+def lambda_function(monkeypatch):
+    pytest.importorskip("boto3")
+    try:
+        pytest.importorskip("weasyprint")
+    except OSError as e:  # installed, but Pango / HarfBuzz are not
+        pytest.skip(f"WeasyPrint cannot load its libraries: {e}")
+    import lambda_function
+
+    def render_batch(bucket, template_entry, event_name, items, defaults, background_color, font_color, seen_keys=None):
+        return [
+            {"index": index, "status": "failed", "error": "bad item"}
+            if item.get("fail")
+            else {"index": index, "status": "succeeded", "s3_path": f"s3://{bucket}/{event_name}/{item['user']}.pdf"}
+            for index, item in enumerate(items)
+        ]
+
+    monkeypatch.setattr(lambda_function, "S3_BUCKET_NAME", "bucket")
+    monkeypatch.setattr(lambda_function, "checkpoint_store", CheckpointStore(FakeS3(), "bucket"))
+    monkeypatch.setattr(lambda_function, "render_batch", render_batch)
+    monkeypatch.setattr(lambda_function, "RESUMABLE_ROUND_SIZE", 2)
+    return lambda_function
+
+
+def test_checkpoint_and_resume(lambda_function):
+    store = lambda_function.checkpoint_store
+    items = [{"user": "a"}, {"user": "b"}, {"user": "c", "fail": True}, {"user": "d"}, {"user": "e"}]
+    token = store.new_token()
+    state = {"payload": {"eventName": "gala", "variableSubstitutions": items}, "cursor": 0, "completed": [], "failures": []}
+
+    paused = lambda_function.render_resumable_batch("bucket", None, token, state, RoundBudget(1))
+    assert paused["statusCode"] == 202
+    body = json.loads(paused["body"])
+    assert (body["continuation_token"], body["cursor"], body["succeeded"]) == (token, 2, 2)
+
+    saved = store.load(token)
+    assert saved["cursor"] == 2 and saved["checkpointed"]
+    finished = lambda_function.render_resumable_batch("bucket", None, token, saved, RoundBudget(10))
+    assert finished["statusCode"] == 200
+    body = json.loads(finished["body"])
+    assert body["completed"] == [f"s3://bucket/gala/{user}.pdf" for user in "abde"]
+    assert body["failures"] == [{"index": 2, "error": "bad item"}]
+    # The finished batch's checkpoint is gone
+    with pytest.raises(LookupError):
+        store.load(token)
+
+
+@pytest.mark.parametrize("token, status", [(12, 400), ("", 400), ("abc123", 404)])
+def test_handler_rejects_bad_tokens(lambda_function, token, status):
+    response = lambda_function.lambda_handler({"body": json.dumps({"continuation_token": token})}, None)
+    assert response["statusCode"] == status
@@ -0,0 +1,68 @@
+import io
+import json
+
+from coordinator import JobStore
+
+
+class FakeS3:
+    """Just enough of an S3 client for JobStore."""
+
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = Body
+
+    def get_object(self, Bucket, Key):
+        return {"Body": io.BytesIO(self.objects[Key])}
+
+    def get_paginator(self, name):
+        assert name == "list_objects_v2"
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        keys = sorted(key for key in self.objects if key.startswith(Prefix))
+        yield {"Contents": [{"Key": key} for key in keys]}
+
+
+def write_job(store, job_id, items, chunk_size):
+    work_items, total_items = store.write_chunks(job_id, items, chunk_size)
+    store.put_json(
+        store.job_key(job_id),
+        {"chunk_size": chunk_size, "chunk_count": len(work_items), "total_items": total_items},
+    )
+    return work_items
+
+
+def test_job_status_reports_failed_chunk():
+    s3 = FakeS3()
+    store = JobStore(s3, "bucket")
+    work_items = write_job(store, "job", [{"user": str(n)} for n in range(5)], 3)
+    assert len(work_items) == 2
+
+    store.put_json(
+        store.status_key("job", 0),
+        {"chunk_index": 0, "succeeded": 2, "failed": 1, "failures": [{"item": 1, "error": "bad"}]},
+    )
+    status = store.job_status("job")
+    assert status["complete"] is False
+    assert status["failed_chunks"] == []
+
+    store.put_json(
+        store.status_key("job", 1),
+        {"chunk_index": 1, "succeeded": 0, "failed": 2, "failures": [], "error": "NoSuchKey"},
+    )
+    status = store.job_status("job")
+    assert status["complete"] is True
+    assert (status["succeeded"], status["failed"]) == (2, 3)
+    assert status["failures"] == [{"item": 1, "error": "bad"}]
+    assert status["failed_chunks"] == [{"chunk_index": 1, "error": "NoSuchKey"}]
+
+
+def test_write_chunks_numbers_items_across_chunks():
+    s3 = FakeS3()
+    store = JobStore(s3, "bucket")
+    work_items = write_job(store, "job", iter(range(7)), 3)
+    chunks = [json.loads(s3.objects[item["chunk_key"]]) for item in work_items]
+    assert [chunk["start"] for chunk in chunks] == [0, 3, 6]
+    assert [len(chunk["items"]) for chunk in chunks] == [3, 3, 1]
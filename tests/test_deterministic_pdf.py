@@ -0,0 +1,119 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+try:
+    pytest.importorskip("weasyprint")
+except OSError as e:  # installed, but Pango / HarfBuzz are not
+    pytest.skip(f"WeasyPrint cannot load its libraries: {e}", allow_module_level=True)
+
+from font_bundle import OfflineFontFetcher
+from render_context import CachingURLFetcher, RenderContext, w3c_date, with_document_date
+from template_cache import TemplateEntry
+from template_renderer import CompiledTemplate
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATE_PATH = os.path.join(REPO_DIR, "event_ticket_template.html")
+
+VARIABLES = {
+    "background_color": "white",
+    "font_color": "black",
+    "breakfast_indicator": "B",
+    "guestFirstNameLastName": "Ada Lovelace",
+}
+
+
+def render_ticket(document_date):
+    with open(TEMPLATE_PATH, encoding="utf-8") as f:
+        html_content, _, _ = CompiledTemplate(f.read()).render(VARIABLES)
+    html_content = with_document_date(html_content, document_date)
+    # A fresh context per render, as in a new container
+    context = RenderContext(
+        url_fetcher=CachingURLFetcher(OfflineFontFetcher(strict=False)), deterministic=True
+    )
+    return context.write_pdf(html_content, REPO_DIR + "/")
+
+
+def test_repeat_renders_are_byte_identical():
+    first = render_ticket("2025-06-01T18:00:00Z")
+    second = render_ticket("2025-06-01T18:00:00Z")
+    assert first.startswith(b"%PDF")
+    assert first == second
+
+
+def test_document_date_changes_the_output():
+    assert render_ticket("2025-06-01T18:00:00Z") != render_ticket("2025-06-02T18:00:00Z")
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("2025-06-01T18:00:00Z", "2025-06-01T18:00:00Z"),
+        ("2025-06-01T18:00:00+02:00", "2025-06-01T16:00:00Z"),
+        ("2025-06-01T18:00:00", "2025-06-01T18:00:00Z"),
+        ("2025-06-01", "2025-06-01T00:00:00Z"),
+        (datetime(2025, 6, 1, 18, 0, 0, 999), "2025-06-01T18:00:00Z"),
+        (datetime(2025, 6, 1, 20, 0, tzinfo=timezone(timedelta(hours=2))), "2025-06-01T18:00:00Z"),
+    ],
+)
+def test_w3c_date(value, expected):
+    assert w3c_date(value) == expected
+
+
+def test_w3c_date_rejects_garbage():
+    with pytest.raises(ValueError):
+        w3c_date("next tuesday")
+
+
+def test_with_document_date_pins_dates_first_in_head():
+    html_content = with_document_date(
+        '<html><head lang="en"><meta name="dcterms.created" content="2000-01-01"></head></html>',
+        "2025-06-01T18:00:00Z",
+    )
+    assert html_content.startswith(
+        '<html><head lang="en"><meta name="dcterms.created" content="2025-06-01T18:00:00Z">'
+        '<meta name="dcterms.modified" content="2025-06-01T18:00:00Z">'
+    )
+
+
+def test_with_document_date_without_head():
+    assert with_document_date("<p>ticket</p>", "2025-06-01T18:00:00Z") == "<p>ticket</p>"
+
+
+@pytest.fixture
+def lambda_function(monkeypatch):
+    pytest.importorskip("boto3")
+    import lambda_function
+
+    monkeypatch.setattr(lambda_function, "DETERMINISTIC_PDF", True)
+    return lambda_function
+
+
+def template_entry(last_modified=None):
+    return TemplateEntry("bucket", "ticket.html", "<html></html>", '"etag"', 13, last_modified)
+
+
+def test_document_date_for_prefers_the_requested_date(lambda_function):
+    entry = template_entry(datetime(2024, 1, 1, tzinfo=timezone.utc))
+    assert lambda_function.document_date_for(entry, "2025-06-01T18:00:00Z") == "2025-06-01T18:00:00Z"
+
+
+def test_document_date_for_falls_back_to_last_modified(lambda_function):
+    entry = template_entry(datetime(2024, 1, 1, 12, 30, tzinfo=timezone.utc))
+    assert lambda_function.document_date_for(entry) == "2024-01-01T12:30:00Z"
+
+
+def test_document_date_for_without_any_date(lambda_function):
+    assert lambda_function.document_date_for(template_entry()) is None
+
+
+def test_document_date_for_rejects_an_invalid_date(lambda_function):
+    with pytest.raises(ValueError):
+        lambda_function.document_date_for(template_entry(), "not a date")
+
+
+def test_document_date_for_when_not_deterministic(lambda_function, monkeypatch):
+    monkeypatch.setattr(lambda_function, "DETERMINISTIC_PDF", False)
+    entry = template_entry(datetime(2024, 1, 1, tzinfo=timezone.utc))
+    assert lambda_function.document_date_for(entry, "2025-06-01T18:00:00Z") is None
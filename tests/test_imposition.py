@@ -0,0 +1,37 @@
+import io
+
+import pytest
+
+pikepdf = pytest.importorskip("pikepdf")
+
+from imposition import ImpositionLayout, impose_pdf
+
+
+def tickets_pdf(count):
+    pdf = pikepdf.Pdf.new()
+    for index in range(count):
+        page = pdf.add_blank_page(page_size=(288, 144))
+        page.obj.Contents = pdf.make_stream(f"0 0 1 rg {index * 10} 0 50 50 re f".encode("ascii"))
+    buffer = io.BytesIO()
+    pdf.save(buffer)
+    return buffer.getvalue()
+
+
+def test_imposed_output_is_byte_identical():
+    pdf_bytes = tickets_pdf(3)
+    layout = ImpositionLayout({"rows": 2, "columns": 2, "copies": 2})
+    assert impose_pdf(pdf_bytes, layout) == impose_pdf(pdf_bytes, layout)
+
+
+def test_imposed_sheets():
+    layout = ImpositionLayout({"rows": 2, "columns": 1, "copies": 1})
+    imposed = pikepdf.Pdf.open(io.BytesIO(impose_pdf(tickets_pdf(3), layout)))
+    assert len(imposed.pages) == 2
+    assert sorted(imposed.pages[0].Resources.XObject.keys()) == ["/Tk0", "/Tk1"]
+    assert sorted(imposed.pages[1].Resources.XObject.keys()) == ["/Tk2"]
+
+
+@pytest.mark.parametrize("options", [[], "letter", 3])
+def test_layout_must_be_an_object(options):
+    with pytest.raises(TypeError):
+        ImpositionLayout(options)
@@ -0,0 +1,72 @@
+import base64
+import json
+
+import pytest
+
+import responses
+from responses import (
+    ENCODE_CHUNK_BYTES,
+    base64_length,
+    base64_text,
+    binary_response,
+    inline_response,
+    json_with_base64,
+)
+
+PAYLOAD_SIZES = [0, 1, 2, 3, ENCODE_CHUNK_BYTES - 1, ENCODE_CHUNK_BYTES, 2 * ENCODE_CHUNK_BYTES + 2]
+
+FIELDS = [
+    {},
+    {"message": ""},
+    {"message": "Billet généré", "guest": "Zoë Ørsted 山田 🎟", "quote": 'a "b" \\ c\n'},
+    {"count": 3, "nested": {"ok": True, "items": [1, None]}},
+]
+
+
+def payload(size):
+    return (bytes(range(256)) * (size // 256 + 1))[:size]
+
+
+@pytest.fixture(params=["orjson", "json"])
+def encoder(request, monkeypatch):
+    if request.param == "orjson":
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(responses, "orjson", None)
+    return request.param
+
+
+@pytest.mark.parametrize("size", PAYLOAD_SIZES)
+@pytest.mark.parametrize("fields", FIELDS)
+def test_json_with_base64_round_trip(encoder, fields, size):
+    data = payload(size)
+    decoded = json.loads(json_with_base64(fields, "pdf_base64", data))
+    assert base64.b64decode(decoded.pop("pdf_base64"), validate=True) == data
+    assert decoded == fields
+
+
+def test_json_with_base64_non_ascii_name(encoder):
+    decoded = json.loads(json_with_base64({"a": 1}, "données", b"\x00\xff"))
+    assert decoded == {"a": 1, "données": base64.b64encode(b"\x00\xff").decode("ascii")}
+
+
+@pytest.mark.parametrize("size", PAYLOAD_SIZES)
+def test_base64_text_matches_b64encode(size):
+    data = payload(size)
+    assert base64_text(data) == base64.b64encode(data).decode("ascii")
+    assert base64_length(size) == len(base64.b64encode(data))
+
+
+def test_inline_response(encoder):
+    response = inline_response({"message": "PDF generated.", "s3_path": "s3://bucket/gala/ada/ticket.pdf"}, b"%PDF-1.7")
+    body = json.loads(response["body"])
+    assert body["response_mode"] == "inline"
+    assert body["s3_path"] == "s3://bucket/gala/ada/ticket.pdf"
+    assert base64.b64decode(body["pdf_base64"]) == b"%PDF-1.7"
+
+
+def test_binary_response():
+    response = binary_response(b"%PDF-1.7", 'ti"cket.pdf')
+    assert response["isBase64Encoded"] is True
+    assert base64.b64decode(response["body"]) == b"%PDF-1.7"
+    assert response["headers"]["Content-Disposition"] == 'inline; filename="ticket.pdf"'
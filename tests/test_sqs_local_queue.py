@@ -0,0 +1,95 @@
+import io
+
+import pytest
+
+from local_queue import InMemoryQueue
+
+TEMPLATE = "<html><body><p>{ guestFirstNameLastName }</p></body></html>"
+
+
+class FakeS3:
+    """Serves the template and records the uploaded PDFs."""
+
+    def __init__(self):
+        self.uploads = {}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        assert Key == "templates/ticket.html"
+        raw = TEMPLATE.encode("utf-8")
+        return {"Body": io.BytesIO(raw), "ETag": '"template"'}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.uploads[Key] = Body
+
+
+def message(user, **fields):
+    return dict(
+        {
+            "template_s3_key": "templates/ticket.html",
+            "eventName": "gala",
+            "user": user,
+            "pdf_filename": "ticket.pdf",
+            "variableSubstitutions": {"guestFirstNameLastName": user},
+        },
+        **fields,
+    )
+
+
+@pytest.fixture
+def lambda_function(monkeypatch):
+    pytest.importorskip("boto3")
+    try:
+        pytest.importorskip("weasyprint")
+    except OSError as e:  # installed, but Pango / HarfBuzz are not
+        pytest.skip(f"WeasyPrint cannot load its libraries: {e}")
+    import lambda_function
+    from template_cache import TemplateCache
+
+    monkeypatch.setattr(lambda_function, "S3_BUCKET_NAME", "bucket")
+    monkeypatch.setattr(lambda_function, "s3_client", FakeS3())
+    monkeypatch.setattr(lambda_function, "template_cache", TemplateCache(max_bytes=1024 * 1024, ttl_seconds=60))
+    return lambda_function
+
+
+def test_bad_message_is_retried_then_dead_lettered(lambda_function):
+    queue = InMemoryQueue(batch_size=10, max_receive_count=3)
+    queue.send_message(message("ada"))
+    bad_id = queue.send_message(message("bob", variableSubstitutions=[{"guest": "bob"}]))
+    unreadable_id = queue.send_message("{not json")
+
+    invocations = queue.drain(lambda_function.sqs_handler)
+
+    # The good message succeeds on the first receive; the other two come back
+    # until their third receive
+    assert invocations == 3
+    assert list(lambda_function.s3_client.uploads) == ["gala/ada/ticket.pdf"]
+    assert lambda_function.s3_client.uploads["gala/ada/ticket.pdf"].startswith(b"%PDF")
+    assert [dead["messageId"] for dead in queue.dead_letters] == [bad_id, unreadable_id]
+    assert all(dead["receive_count"] == 3 for dead in queue.dead_letters)
+    assert len(queue) == 0
+
+
+def test_handler_error_returns_the_whole_batch(lambda_function, monkeypatch):
+    monkeypatch.setattr(lambda_function, "S3_BUCKET_NAME", None)
+    queue = InMemoryQueue(batch_size=10, max_receive_count=2)
+    queue.send_message(message("ada"))
+    queue.send_message(message("bob"))
+
+    assert queue.drain(lambda_function.sqs_handler) == 2
+    assert len(queue.dead_letters) == 2
+    assert lambda_function.s3_client.uploads == {}
+
+
+def test_partial_batch_failure_requeues_only_failed_messages():
+    queue = InMemoryQueue(batch_size=2, max_receive_count=2)
+    first = queue.send_message({"n": 1})
+    second = queue.send_message({"n": 2})
+    received = []
+
+    def handler(event, context):
+        received.append([record["messageId"] for record in event["Records"]])
+        return {"batchItemFailures": [{"itemIdentifier": second}]}
+
+    assert queue.drain(handler) == 2
+    assert received == [[first, second], [second]]
+    assert [dead["messageId"] for dead in queue.dead_letters] == [second]
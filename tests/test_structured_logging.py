@@ -0,0 +1,67 @@
+import json
+import logging
+from types import SimpleNamespace
+
+import pytest
+
+from structured_logging import RequestLogging, level_number
+
+
+@pytest.fixture
+def captured(monkeypatch):
+    """The root logger with one handler whose output lands in a list."""
+    root = logging.getLogger()
+    lines = []
+    handler = logging.Handler()
+    handler.emit = lambda record: lines.append(json.loads(handler.format(record)))
+    monkeypatch.setattr(root, "handlers", [handler])
+    monkeypatch.setattr(root, "level", root.level)
+    yield lines
+
+
+def test_level_number():
+    assert level_number("debug") == logging.DEBUG
+    assert level_number(" WARNING ") == logging.WARNING
+    assert level_number(logging.ERROR) == logging.ERROR
+    assert level_number("verbose") == logging.INFO
+
+
+def test_unknown_level_falls_back_to_info(captured):
+    request_logging = RequestLogging(logging.getLogger("test_app.unknown"), level="verbose")
+    request_logging.install()
+    assert request_logging.logger.level == logging.INFO
+    assert captured[0]["level"] == "WARNING"
+    assert "verbose" in captured[0]["message"]
+
+
+def test_sampled_request_only_raises_app_logger(captured):
+    app_logger = logging.getLogger("test_app.sampled")
+    request_logging = RequestLogging(app_logger, level="INFO", sample_rate=1)
+    request_logging.install()
+
+    @request_logging.handler
+    def handler(event, context):
+        app_logger.debug("app detail")
+        logging.getLogger("botocore.endpoint").debug("library detail")
+        return {"ok": True}
+
+    handler({"body": "{}"}, SimpleNamespace(aws_request_id="request-1"))
+    messages = [line["message"] for line in captured]
+    assert "app detail" in messages
+    assert "library detail" not in messages
+    assert all(line["request_id"] == "request-1" for line in captured)
+    assert app_logger.level == logging.INFO
+
+
+def test_unsampled_request_stays_at_level(captured):
+    app_logger = logging.getLogger("test_app.unsampled")
+    request_logging = RequestLogging(app_logger, level="INFO", sample_rate=0)
+    request_logging.install()
+
+    @request_logging.handler
+    def handler(event, context):
+        app_logger.debug("app detail")
+        app_logger.info("app summary")
+
+    handler({}, SimpleNamespace(aws_request_id="request-2"))
+    assert [line["message"] for line in captured] == ["app summary"]
@@ -0,0 +1,53 @@
+import time
+import zipfile
+
+# Fixed-size part of a ZIP local file header, before the file name and extra field
+LOCAL_HEADER_SIZE = 30
+
+
+class StreamingTicketArchive:
+    """
+    ZIP archive written straight into a forward-only stream (an
+    S3MultipartWriter), one PDF at a time, so only the member being added is
+    held in memory.
+
+    Members are STORED rather than deflated: PDFs are already compressed, and it
+    means every member's bytes sit unmodified at a known offset, so the JSON
+    index from index() lets a client fetch a single ticket with an S3 range GET.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.zip_file = zipfile.ZipFile(stream, mode="w", compression=zipfile.ZIP_STORED)
+        self.members = []
+
+    def add(self, name, data, **metadata):
+        zinfo = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+        zinfo.compress_type = zipfile.ZIP_STORED
+        self.zip_file.writestr(zinfo, data)
+        data_offset = (
+            zinfo.header_offset
+            + LOCAL_HEADER_SIZE
+            + len(zinfo.filename.encode("utf-8"))
+            + len(zinfo.extra)
+        )
+        self.members.append(
+            dict(
+                metadata,
+                name=name,
+                offset=data_offset,
+                size=len(data),
+                crc32=zinfo.CRC,
+            )
+        )
+
+    def close(self):
+        """Writes the central directory; closing the underlying stream is up to the caller."""
+        self.zip_file.close()
+
+    def index(self, archive_url):
+        return {
+            "archive": archive_url,
+            "size": self.stream.tell(),
+            "members": self.members,
+        }